@@ -10,35 +10,65 @@ import re
 import tempfile
 
 import requests
+import ujson as json
+from requests.adapters import HTTPAdapter
+from concurrent import futures
 
+from camlipy.cache import FileCache, BlobCache, ReadCache, READ_CACHE_SIZE
+from camlipy.multipart import MultipartEncoder
 from camlipy.filewriter import put_file
-from camlipy.filereader import get_file
+from camlipy.filereader import get_file, open_file, FETCH_WORKERS
 from camlipy.directory import put_directory, get_directory
 from camlipy.search import Search
 from camlipy.schema import Permanode, PlannedPermanode, StaticSet
 
-__all__ = ['compute_hash', 'check_hash', 'Camlistore']
+__all__ = ['compute_hash', 'check_hash', 'sniff_schema', 'Blob', 'HashPool', 'Camlistore']
 
 CAMLIVERSION = 1
 MAX_STAT_BLOB = 1000
 DEBUG = False
+# Size of the blocks read when hashing a fileobj, hashlib releases
+# the GIL while hashing, so big blocks let threads hash in parallel.
+HASH_BLOCK_SIZE = 1 << 20
+# Default number of hashing threads.
+HASH_WORKERS = 4
+# HTTP connections pool settings: number of hosts
+# with a connections pool, and connections kept per host.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+# Number of batches uploaded concurrently by put_blobs.
+UPLOAD_WORKERS = 1
+# Number of stat requests (of MAX_STAT_BLOB blobs) performed concurrently.
+STAT_WORKERS = 4
+# Supported hash functions, and the default one.
+HASH_ALGOS = ('sha1', 'sha224')
+DEFAULT_HASH_ALGO = 'sha1'
+# Schema blobs are JSON objects up to 1MB, only blobs starting
+# with "{" (in the first SNIFF_SIZE bytes) are parsed.
+MAX_SCHEMA_BLOB_SIZE = 1 << 20
+SNIFF_SIZE = 1 << 10
 
 log = logging.getLogger(__name__)
 
 
-def compute_hash(data, blocksize=4096):
+def compute_hash(data, blocksize=HASH_BLOCK_SIZE, hash_algo=DEFAULT_HASH_ALGO):
     """ Return the hash object for the file `filepath', processing the file
     by chunk of `blocksize'.
 
     :type filepath: data
-    :param filepath: string or fileobj
+    :param filepath: string, buffer/memoryview or fileobj
 
     :type blocksize: int
     :param blocksize: Size of the chunk when processing the file
 
+    :type hash_algo: str
+    :param hash_algo: Hash function, one of HASH_ALGOS
+
     """
-    sha = hashlib.sha1()
-    if isinstance(data, basestring):
+    if isinstance(data, Blob):
+        return data.blob_ref
+    sha = hashlib.new(hash_algo)
+    if isinstance(data, (basestring, buffer, memoryview)):
         sha.update(data)
     else:
         start = data.tell()
@@ -49,12 +79,120 @@ def compute_hash(data, blocksize=4096):
             else:
                 break
         data.seek(start)
-    return 'sha1-{0}'.format(sha.hexdigest())
+    return '{0}-{1}'.format(hash_algo, sha.hexdigest())
+
+
+class Blob(object):
+    """ Blob data along with its size and blobRef,
+    so the data is hashed only once, accepted by
+    Camlistore.put_blobs/put_blob.
+
+    Args:
+        data: string, buffer/memoryview or fileobj
+        blob_ref: blobRef of the data if already known,
+            else it's computed on first access
+        hash_algo: hash function used to compute the blobRef
+
+    """
+    __slots__ = ('data', 'size', 'hash_algo', '_blob_ref')
+
+    def __init__(self, data, blob_ref=None, hash_algo=DEFAULT_HASH_ALGO):
+        self.data = data
+        self.hash_algo = hash_algo
+        self._blob_ref = blob_ref
+        if isinstance(data, (basestring, buffer, memoryview)):
+            self.size = len(data)
+        else:
+            start = data.tell()
+            data.seek(0, 2)
+            self.size = data.tell() - start
+            data.seek(start)
+
+    @property
+    def blob_ref(self):
+        if self._blob_ref is None:
+            self._blob_ref = compute_hash(self.data, hash_algo=self.hash_algo)
+        return self._blob_ref
+
+    def __repr__(self):
+        return '<Blob {0} {1}bytes>'.format(self.blob_ref, self.size)
+
+
+class HashPool(object):
+    """ Pool of threads hashing blobs and files.
+
+    hashlib releases the GIL while hashing big buffers,
+    so blobs are hashed in parallel by `workers' threads,
+    fileobjs being read by blocks of `blocksize' bytes,
+    with the `hash_algo' hash function.
+
+    """
+    def __init__(self, workers=HASH_WORKERS, blocksize=HASH_BLOCK_SIZE,
+                 hash_algo=DEFAULT_HASH_ALGO):
+        self.workers = workers
+        self.blocksize = blocksize
+        self.hash_algo = hash_algo
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, data):
+        """ Hash the data in the pool, returns a future of its blobRef. """
+        return self.executor.submit(compute_hash, data, self.blocksize, self.hash_algo)
+
+    def hash_blobs(self, blobs):
+        """ Compute the blobRef of the Blobs that don't have one yet. """
+        missing = [blob for blob in blobs if blob._blob_ref is None]
+        if len(missing) < 2:
+            # Not worth the round-trip to the pool
+            for blob in missing:
+                blob._blob_ref = compute_hash(blob.data, self.blocksize, self.hash_algo)
+            return
+        for blob, future in [(blob, self.submit(blob.data)) for blob in missing]:
+            blob._blob_ref = future.result()
+
+    def read_files(self, paths):
+        """ Read and hash the files in the pool, returns their Blobs. """
+        return list(self.executor.map(self._read_file, paths))
+
+    def _read_file(self, path):
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        return Blob(data, compute_hash(data, self.blocksize, self.hash_algo), self.hash_algo)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def sniff_schema(fileobj):
+    """ Return the schema (as a dict) if the blob in `fileobj'
+    is a schema, else None (the fileobj is rewound).
+
+    Like Camlistore, a schema blob is a JSON object of at most
+    MAX_SCHEMA_BLOB_SIZE bytes, with a camliVersion key.
+
+    """
+    prefix = fileobj.read(SNIFF_SIZE)
+    fileobj.seek(0)
+    if not prefix.lstrip().startswith('{'):
+        return
+    data = fileobj.read(MAX_SCHEMA_BLOB_SIZE + 1)
+    fileobj.seek(0)
+    if len(data) > MAX_SCHEMA_BLOB_SIZE or '"camliVersion"' not in data:
+        return
+    try:
+        schema = json.loads(data)
+    except ValueError:
+        return
+    if isinstance(schema, dict) and 'camliVersion' in schema:
+        return schema
 
 
 def check_hash(_hash):
-    """ Check if the hash is valid. """
-    return bool(re.match(r'sha1-[a-fA-F0-9]{40}', _hash))
+    """ Check if the hash is valid (for any of the HASH_ALGOS). """
+    hash_algo, _, digest = _hash.partition('-')
+    if hash_algo not in HASH_ALGOS:
+        return False
+    digest_len = hashlib.new(hash_algo).digest_size * 2
+    return bool(re.match(r'[a-fA-F0-9]{{{0}}}'.format(digest_len), digest))
 
 
 class Camlistore(object):
@@ -63,15 +201,57 @@ class Camlistore(object):
     Args:
         server: server address
         auth: tuple (user, password) if authentication is enabled.
+        file_cache: path of the uploaded files cache database
+                    (see camlipy.cache.FileCache), disabled if None.
+        hash_workers: number of threads hashing blobs (see HashPool).
+        hash_algo: hash function used for blobRefs (one of HASH_ALGOS),
+                   detected from the server configuration if None.
+        pool_connections: number of hosts with a pool of HTTP connections.
+        pool_maxsize: maximum number of HTTP connections kept per host.
+        upload_workers: number of batches uploaded concurrently by put_blobs.
+        blob_cache: path of the known blobs index database
+                    (see camlipy.cache.BlobCache), disabled if None.
+        read_cache: directory of the downloaded blobs cache
+                    (see camlipy.cache.ReadCache), disabled if None.
+        read_cache_size: maximum size of the read cache (bytes).
+
+    Every HTTP request (including the ones from the schema and search
+    modules) goes through the instance session, so connections are kept
+    alive and reused.
 
     """
-    def __init__(self, server='http://localhost:3179', auth=None):
+    def __init__(self, server='http://localhost:3179', auth=None, file_cache=None,
+                 hash_workers=HASH_WORKERS, hash_algo=None,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 upload_workers=UPLOAD_WORKERS, blob_cache=None,
+                 read_cache=None, read_cache_size=READ_CACHE_SIZE):
         self.server = server
         self.auth = auth
+        self.upload_workers = upload_workers
+        self.session = self._create_session(pool_connections, pool_maxsize)
         self.conf = self._conf_discovery()
+        # Updated after each stat
+        self.max_upload_size = None
+
+        self.file_cache = None
+        if file_cache is not None:
+            self.file_cache = FileCache(file_cache)
+
+        self.blob_cache = None
+        if blob_cache is not None:
+            self.blob_cache = BlobCache(blob_cache)
+
+        self.read_cache = None
+        if read_cache is not None:
+            self.read_cache = ReadCache(read_cache, read_cache_size)
 
         self.public_key_blob_ref = self.conf['signing']['publicKeyBlobRef']
 
+        if hash_algo is None:
+            hash_algo = self._hash_algo_discovery()
+        self.hash_algo = hash_algo
+        self.hash_pool = HashPool(hash_workers, hash_algo=hash_algo)
+
         self.url_blobRoot = urlparse.urljoin(self.server,
                                              self.conf['blobRoot'])
         self.url_signHandler = urlparse.urljoin(self.server,
@@ -79,58 +259,138 @@ class Camlistore(object):
         self.url_searchRoot = urlparse.urljoin(self.server,
                                                self.conf['searchRoot'])
 
+    def _create_session(self, pool_connections, pool_maxsize):
+        """ Return the pooled requests session used for every request. """
+        session = requests.Session()
+        session.auth = self.auth
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        """ Close the HTTP connections, the hashing threads and the caches. """
+        self.session.close()
+        self.hash_pool.shutdown()
+        if self.file_cache is not None:
+            self.file_cache.close()
+        if self.blob_cache is not None:
+            self.blob_cache.close()
+        if self.read_cache is not None:
+            self.read_cache.close()
+
     def _conf_discovery(self):
         """ Perform a discovery to gather server configuration. """
-        r = requests.get(self.server,
+        r = self.session.get(self.server,
                          auth=self.auth,
                          headers={'Accept': 'text/x-camli-configuration'})
         r.raise_for_status()
         return r.json()
 
-    @staticmethod
-    def get_hash(blob):
-        return compute_hash(blob)
+    def _hash_algo_discovery(self):
+        """ Return the hash function used by the server, the one
+        of the blobRef of its public key (the default one if unknown). """
+        hash_algo = self.public_key_blob_ref.partition('-')[0]
+        if hash_algo in HASH_ALGOS:
+            return hash_algo
+        return DEFAULT_HASH_ALGO
+
+    def get_hash(self, blob):
+        """ Return the blobRef of the blob, using the server hash function. """
+        return compute_hash(blob, hash_algo=self.hash_algo)
 
     def get_blob(self, blobref):
         """
         Retrieve blob content,
         return a fileobj.
         If the blob is a schema, it returns a dict.
+
+        The blob type is sniffed from its content (see sniff_schema),
+        use get_blob_data/get_schema_blob if you know what to expect.
         """
+        blob = self.get_blob_data(blobref)
+        if blob is None:
+            return
+        schema = sniff_schema(blob)
+        if schema is not None:
+            return schema
+        return blob
+
+    def get_blob_data(self, blobref):
+        """ Retrieve blob content as a fileobj,
+        even if it's a schema (None if the blob doesn't exist). """
+        if self.read_cache is not None:
+            cached = self.read_cache.get(blobref)
+            if cached is not None:
+                return cached
+
         if DEBUG:
             log.debug('Fetching blobref:{0}'.format(blobref))
         blobref_url = urlparse.urljoin(self.url_blobRoot,
                                        'camli/{0}'.format(blobref))
 
-        r = requests.get(blobref_url, auth=self.auth, stream=True)
+        r = self.session.get(blobref_url, auth=self.auth, stream=True)
 
         if r.status_code == 404:
+            r.close()
             return
         elif r.status_code == 200:
             # Store the blob in memory, and write it to disk if it exceed 1MB
             out = tempfile.SpooledTemporaryFile(max_size=1024 << 10)
-
-            # Check if the blob contains binary data
-            if not self.describe_blob(blobref).get('camliType'):
-                while 1:
-                    buf = r.raw.read(512 << 10)
-                    if buf:
-                        out.write(buf)
-                    else:
-                        break
-
-                out.seek(0)
-                return out
-            else:
-                # If the blob is not binary data,
-                # then, it's a schema, so we return a dict.
-                return r.json()
+            while 1:
+                buf = r.raw.read(512 << 10)
+                if buf:
+                    out.write(buf)
+                else:
+                    break
+
+            out.seek(0)
+            if self.read_cache is not None:
+                self.read_cache.put(blobref, out)
+            return out
 
         r.raise_for_status()
 
-    def _stat(self, blobrefs=[]):
+    def get_schema_blob(self, blobref):
+        """ Retrieve a schema blob as a dict
+        (None if the blob doesn't exist). """
+        blob = self.get_blob_data(blobref)
+        if blob is None:
+            return
+        schema = sniff_schema(blob)
+        if schema is None:
+            raise Exception('Blob {0} is not a schema'.format(blobref))
+        return schema
+
+    def _stat(self, blobrefs=[], stat_workers=STAT_WORKERS):
         """ Perform a multi-stat on blobs
-        to check if some are already present. """
+        to check if some are already present.
+
+        Blobrefs are stated by pages of MAX_STAT_BLOB, up to `stat_workers'
+        pages at a time, the stat results are merged and the uploadUrl
+        is the one returned for the first page.
+        """
+        blobrefs = list(blobrefs)
+        pages = [blobrefs[i:i + MAX_STAT_BLOB]
+                 for i in xrange(0, len(blobrefs), MAX_STAT_BLOB)] or [[]]
+        if stat_workers > 1 and len(pages) > 1:
+            if DEBUG:
+                log.debug('Perform {0} stats concurrently'.format(len(pages)))
+            executor = futures.ThreadPoolExecutor(max_workers=min(stat_workers, len(pages)))
+            with executor:
+                pages_res = list(executor.map(self._stat_page, pages))
+        else:
+            pages_res = map(self._stat_page, pages)
+
+        res = pages_res[0]
+        res['stat'] = res['stat'] or []
+        for page_res in pages_res[1:]:
+            res['stat'].extend(page_res['stat'] or [])
+        return res
+
+    def _stat_page(self, blobrefs):
+        """ Perform a single stat request, for up to MAX_STAT_BLOB blobrefs. """
         if DEBUG:
             log.debug('Perform stat')
         stat_url = urlparse.urljoin(self.url_blobRoot, 'camli/stat')
@@ -139,7 +399,7 @@ class Camlistore(object):
         for i, blobref in enumerate(blobrefs):
             stat_data['blob{0}'.format(i + 1)] = blobref
 
-        r = requests.post(stat_url, data=stat_data, auth=self.auth)
+        r = self.session.post(stat_url, data=stat_data, auth=self.auth)
 
         if DEBUG:
             log.debug(r.text)
@@ -147,23 +407,47 @@ class Camlistore(object):
         r.raise_for_status()
         return r.json()
 
-    def put_blobs(self, blobs):
+    def put_blobs(self, blobs, upload_workers=None):
         """ Upload blobs using with standard multi-part upload.
         Returns a dict with received (blobref and size) and skipped (blobref only)
+
+        Blobs can be Blob instances, strings, buffers or fileobjs.
+
+        Missing blobs are uploaded in batches of up to maxUploadSize bytes,
+        `upload_workers' batches at a time (defaults to the instance
+        `upload_workers', one batch at a time).
         """
+        blobs = [blob if isinstance(blob, Blob) else Blob(blob, hash_algo=self.hash_algo)
+                 for blob in blobs]
+        self.hash_pool.hash_blobs(blobs)
+
         # First we create a dict {blobRef: blob, ...}
         blobrefs = {}
         for blob in blobs:
-            blobrefs[compute_hash(blob)] = blob
+            blobrefs[blob.blob_ref] = blob
 
         # And a set containing every blobRefs
         blobrefs_all = frozenset(blobrefs.keys())
 
+        # Blobs already known to be on the server don't need to be stated
+        known = []
+        if self.blob_cache is not None:
+            known = [{'blobRef': br, 'size': size} for br, size in
+                     self.blob_cache.get(self.server, blobrefs_all).iteritems()]
+        blobrefs_known = frozenset([s['blobRef'] for s in known])
+
+        if blobrefs_known and blobrefs_known == blobrefs_all:
+            if DEBUG:
+                log.debug('All blobs are known, skipping stat')
+            return {'skipped': known, 'received': [], 'success': list(blobrefs_all)}
+
         # Perform a stat to check which blobs are already present
         # and to fetch uploadUrl and maxUploadSize.
-        stat_res = self._stat(blobrefs_all)
+        stat_res = self._stat(blobrefs_all - blobrefs_known)
         upload_url = stat_res['uploadUrl']
         max_upload_size = stat_res['maxUploadSize']
+        self.max_upload_size = max_upload_size
+        stat_res['stat'].extend(known)
 
         blobrefs_stat = frozenset([s['blobRef'] for s in stat_res['stat']])
 
@@ -177,47 +461,31 @@ class Camlistore(object):
         res = {'skipped': stat_res['stat'],
                'received': []}
 
-        if DEBUG:
-            log.debug('Starting first upload batch')
-
-        batch_size = 0
-        r_files = {}
-
-        for br in blobrefs_missing:
-            blob = blobrefs[br]
-            bref = compute_hash(blob)
-            if isinstance(blob, basestring):
-                blob_content = blob
-                blob_size = len(blob)
-            else:
-                blob_content = blob.read()
-                # Seek to the end of the file
-                blob.seek(0, 2)
-                blob_size = blob.tell()
-
-            if batch_size + blob_size > max_upload_size:
-                if DEBUG:
-                    log.debug('Upload first batch before continue, batch size:{0}'.format(batch_size))
-                batch_res = self._put_blobs(upload_url, r_files)
+        upload_workers = upload_workers or self.upload_workers
+        batches = self._batches([blobrefs[br] for br in blobrefs_missing], max_upload_size)
+        if upload_workers > 1 and len(batches) > 1:
+            if DEBUG:
+                log.debug('Uploading {0} batches concurrently'.format(len(batches)))
+            # Every batch is sent to the uploadUrl returned by the stat
+            executor = futures.ThreadPoolExecutor(max_workers=min(upload_workers, len(batches)))
+            with executor:
+                batches_res = list(executor.map(lambda batch: self._upload_batch(upload_url, batch),
+                                                batches))
+        else:
+            batches_res = []
+            for batch in batches:
+                batch_res = self._upload_batch(upload_url, batch)
                 # Retrieve the next upload url
                 upload_url = batch_res['uploadUrl']
+                batches_res.append(batch_res)
 
-                res['received'].extend(batch_res['received'])
-                r_files = {}
-                batch_size = 0
-
-            r_files[bref] = (bref, blob_content)
-            batch_size += blob_size
-
-        if r_files.keys():
-            if DEBUG:
-                log.debug('Current batch size: {0}'.format(batch_size))
-                log.debug('Uploading last batch')
-
-            batch_res = self._put_blobs(upload_url, r_files)
-
+        for batch_res in batches_res:
             res['received'].extend(batch_res['received'])
 
+        if self.blob_cache is not None:
+            self.blob_cache.add(self.server, res['received'] +
+                                [s for s in res['skipped'] if s['blobRef'] not in blobrefs_known])
+
         blobs_received = [d['blobRef'] for d in res['received']]
         blobs_skipped = [d['blobRef'] for d in res['skipped']]
 
@@ -236,14 +504,39 @@ class Camlistore(object):
 
         return res
 
-    def _put_blobs(self, upload_url, r_files):
+    def _batches(self, blobs, max_upload_size):
+        """ Split the Blobs in batches of up to `max_upload_size' bytes
+        (a blob bigger than `max_upload_size' gets its own batch). """
+        batches = []
+        batch_size = 0
+        for blob in blobs:
+            if not batches or (batches[-1] and batch_size + blob.size > max_upload_size):
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(blob)
+            batch_size += blob.size
+        return batches
+
+    def _upload_batch(self, upload_url, batch):
+        """ Upload a batch of Blobs, returns the upload response. """
+        if DEBUG:
+            log.debug('Upload batch, size:{0}'.format(sum([blob.size for blob in batch])))
+        return self._put_blobs(upload_url, batch)
+
+    def _put_blobs(self, upload_url, blobs):
         """ Perform the multi-part upload/
-        Batch uploader. """
+        Batch uploader.
+
+        The body is streamed (see camlipy.multipart), the blobs
+        are read while they're sent.
+        """
         if DEBUG:
             log.debug('Starting multi-part upload')
-        r = requests.post(upload_url,
-                          files=r_files,
-                          auth=self.auth)
+        body = MultipartEncoder([(blob.blob_ref, blob.data, blob.size) for blob in blobs])
+        r = self.session.post(upload_url,
+                              data=body,
+                              headers={'Content-Type': body.content_type},
+                              auth=self.auth)
 
         if DEBUG:
             log.debug(r.text)
@@ -256,7 +549,7 @@ class Camlistore(object):
         """ Return blob meta data. """
         describe = 'camli/search/describe?blobref={0}'.format(blobref)
         describe_url = urlparse.urljoin(self.url_searchRoot, describe)
-        r = requests.get(describe_url, auth=self.auth)
+        r = self.session.get(describe_url, auth=self.auth)
         r.raise_for_status()
         return r.json().get('meta', {}).get(blobref, {})
 
@@ -274,29 +567,44 @@ class Camlistore(object):
     def put_blob(self, blob):
         """ Shortcut/helper for uploading a single blob.
 
-        Blob can be either a string or a fileobj.
+        Blob can be either a Blob, a string or a fileobj.
 
         """
+        if not isinstance(blob, Blob):
+            blob = Blob(blob, hash_algo=self.hash_algo)
         res = self.put_blobs([blob])
-        blob_ref = compute_hash(blob)
+        blob_ref = blob.blob_ref
         if blob_ref in res['success']:
             return blob_ref
 
-    def put_file(self, path=None, fileobj=None, permanode=False):
+    def put_file(self, path=None, fileobj=None, permanode=False, use_mmap=True,
+                 processes=None, incremental=False, chunker=None):
         """ Shortcut for uploading a file along with its meta-data.
 
         Call camlipy.filewriter.put_file under the hood.
 
         """
-        return put_file(self, path=path, fileobj=fileobj, permanode=permanode)
+        return put_file(self, path=path, fileobj=fileobj, permanode=permanode,
+                        use_mmap=use_mmap, processes=processes,
+                        incremental=incremental, chunker=chunker)
 
-    def get_file(self, blob_ref, fileobj=None):
-        """ Shortcut for downloading/restoring a file.
+    def get_file(self, blob_ref, fileobj=None, workers=FETCH_WORKERS):
+        """ Shortcut for downloading/restoring a file,
+        `workers' chunks are fetched concurrently.
 
         Call camlipy.filereader.get_file under the hood.
 
         """
-        return get_file(self, blob_ref=blob_ref, fileobj=fileobj)
+        return get_file(self, blob_ref=blob_ref, fileobj=fileobj, workers=workers)
+
+    def open_file(self, blob_ref):
+        """ Shortcut for reading a file without downloading it,
+        returns a read-only seekable fileobj.
+
+        Call camlipy.filereader.open_file under the hood.
+
+        """
+        return open_file(self, blob_ref)
 
     def put_directory(self, path, permanode=False):
         """ Shortcut for upload an entire directory.
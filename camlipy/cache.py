@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+""" Local caches, to avoid re-uploading/re-downloading data. """
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import ujson as json
+
+log = logging.getLogger(__name__)
+
+# Maximum number of blobRefs per query (SQLite limits the number of variables).
+MAX_QUERY_BLOBS = 500
+# Default size of the read cache (bytes).
+READ_CACHE_SIZE = 1 << 30
+# Size of the blocks copied into the read cache.
+COPY_BLOCK_SIZE = 1 << 20
+
+
+def file_identity(path):
+    """ Return the identity of the file at `path',
+    (device, inode, size, mtime, ctime), it changes
+    whenever the file data or meta-data are updated. """
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+class FileCache(object):
+    """ On-disk cache of the uploaded files, keyed by server and path.
+
+    For each file, the file identity (see `file_identity')
+    is stored along with the file schema blobRef and its parts,
+    so an unchanged file doesn't need to be read/uploaded again.
+
+    The chunking state of append-only files is also stored,
+    to only chunk the appended data (see FileWriter.resume).
+
+    Args:
+        db_path: path of the SQLite database
+
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                            'server TEXT, path TEXT, dev INTEGER, ino INTEGER, '
+                            'size INTEGER, mtime REAL, ctime REAL, '
+                            'blob_ref TEXT, parts TEXT, '
+                            'PRIMARY KEY (server, path))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS chunk_states ('
+                            'server TEXT, path TEXT, state TEXT, '
+                            'PRIMARY KEY (server, path))')
+
+    def get(self, server, path, identity):
+        """ Return (file schema blobRef, parts) if the file
+        is cached and hasn't changed since, else None. """
+        path = os.path.abspath(path)
+        with self.lock:
+            row = self.db.execute('SELECT dev, ino, size, mtime, ctime, blob_ref, parts '
+                                  'FROM files WHERE server = ? AND path = ?',
+                                  (server, path)).fetchone()
+        if row is None or tuple(row[:5]) != tuple(identity):
+            return None
+        return row[5], json.loads(row[6])
+
+    def set(self, server, path, identity, blob_ref, parts):
+        """ Store the file schema blobRef and its parts. """
+        path = os.path.abspath(path)
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO files VALUES '
+                                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (server, path) + tuple(identity) +
+                                (blob_ref, json.dumps(parts)))
+
+    def get_state(self, server, path):
+        """ Return the last chunking state of the file
+        (see FileWriter.state), or None. """
+        path = os.path.abspath(path)
+        with self.lock:
+            row = self.db.execute('SELECT state FROM chunk_states '
+                                  'WHERE server = ? AND path = ?',
+                                  (server, path)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_state(self, server, path, state):
+        """ Store the chunking state of the file. """
+        path = os.path.abspath(path)
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO chunk_states VALUES (?, ?, ?)',
+                                (server, path, json.dumps(state)))
+
+    def invalidate(self, server=None, path=None):
+        """ Remove the given path (or every path if None)
+        for the given server (or every server if None). """
+        query = ' WHERE 1'
+        args = ()
+        if server is not None:
+            query += ' AND server = ?'
+            args += (server,)
+        if path is not None:
+            query += ' AND path = ?'
+            args += (os.path.abspath(path),)
+        with self.lock:
+            with self.db:
+                for table in ('files', 'chunk_states'):
+                    self.db.execute('DELETE FROM ' + table + query, args)
+
+    def close(self):
+        self.db.close()
+
+
+class BlobCache(object):
+    """ On-disk index of the blobs known to be present on a server.
+
+    Filled from the blobs received or skipped by Camlistore.put_blobs,
+    and checked before the stat, so blobs already uploaded don't need
+    to be stated again.
+
+    The server can't tell us when a blob is removed (e.g. garbage
+    collected, or the server is reset), call `invalidate' then.
+
+    Args:
+        db_path: path of the SQLite database
+
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                            'server TEXT, blob_ref TEXT, size INTEGER, '
+                            'PRIMARY KEY (server, blob_ref))')
+
+    def get(self, server, blob_refs):
+        """ Return a dict {blobRef: size} of the
+        given blobRefs known to be on the server. """
+        blob_refs = list(blob_refs)
+        known = {}
+        with self.lock:
+            for i in xrange(0, len(blob_refs), MAX_QUERY_BLOBS):
+                page = blob_refs[i:i + MAX_QUERY_BLOBS]
+                rows = self.db.execute('SELECT blob_ref, size FROM blobs '
+                                       'WHERE server = ? AND blob_ref IN '
+                                       '(' + ', '.join('?' * len(page)) + ')',
+                                       [server] + page)
+                known.update(rows)
+        return known
+
+    def add(self, server, blobs):
+        """ Store the blobs ({'blobRef': br, 'size': size} dicts,
+        as returned by the stat/upload) as present on the server. """
+        with self.lock:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                                    [(server, blob['blobRef'], blob['size'])
+                                     for blob in blobs])
+
+    def invalidate(self, server=None, blob_refs=None):
+        """ Remove the given blobRefs (or every blob if None)
+        for the given server (or every server if None). """
+        query = 'DELETE FROM blobs WHERE 1'
+        args = []
+        if server is not None:
+            query += ' AND server = ?'
+            args.append(server)
+        with self.lock:
+            with self.db:
+                if blob_refs is None:
+                    self.db.execute(query, args)
+                    return
+                blob_refs = list(blob_refs)
+                for i in xrange(0, len(blob_refs), MAX_QUERY_BLOBS):
+                    page = blob_refs[i:i + MAX_QUERY_BLOBS]
+                    self.db.execute(query + ' AND blob_ref IN '
+                                    '(' + ', '.join('?' * len(page)) + ')',
+                                    args + page)
+
+    def close(self):
+        self.db.close()
+
+
+class ReadCache(object):
+    """ Size-bounded on-disk cache of the downloaded blobs.
+
+    Blobs are immutable, so a blob is never fetched again once cached.
+    Each blob is stored in its own file (named by its blobRef), along
+    with an SQLite index of the sizes and last access times, used to
+    evict the least recently used blobs when the cache exceeds `max_size'.
+
+    The blob hash is checked before it's added, and files are moved
+    in place atomically, so the cache can be shared between processes.
+
+    Args:
+        cache_dir: directory of the cache, created if needed
+        max_size: maximum size of the cached blobs (bytes)
+
+    """
+    def __init__(self, cache_dir, max_size=READ_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'index.db'),
+                                  check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                            'blob_ref TEXT PRIMARY KEY, size INTEGER, atime REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS blobs_atime ON blobs (atime)')
+
+    def _path(self, blob_ref):
+        digest = blob_ref.split('-', 1)[-1]
+        return os.path.join(self.cache_dir, digest[:2], blob_ref)
+
+    def get(self, blob_ref):
+        """ Return the cached blob as a fileobj, or None. """
+        with self.lock:
+            with self.db:
+                cur = self.db.execute('UPDATE blobs SET atime = ? WHERE blob_ref = ?',
+                                      (time.time(), blob_ref))
+        if not cur.rowcount:
+            return None
+        try:
+            return open(self._path(blob_ref), 'rb')
+        except IOError:
+            # Evicted in the meantime (by another process)
+            return None
+
+    def put(self, blob_ref, fileobj):
+        """ Add the blob data from `fileobj' to the cache (the fileobj
+        is rewound), raise an Exception if it doesn't match the blobRef. """
+        hash_algo, digest = blob_ref.split('-', 1)
+        sha = hashlib.new(hash_algo)
+        path = self._path(blob_ref)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created by another thread/process
+                pass
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while 1:
+                    buf = fileobj.read(COPY_BLOCK_SIZE)
+                    if not buf:
+                        break
+                    sha.update(buf)
+                    out.write(buf)
+                    size += len(buf)
+            fileobj.seek(0)
+            if sha.hexdigest() != digest:
+                raise Exception('Blob {0} doesn\'t match its hash'.format(blob_ref))
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                                (blob_ref, size, time.time()))
+                self._evict()
+
+    def _evict(self):
+        """ Remove the least recently used blobs until
+        the cache size is below `max_size'. """
+        total = self.db.execute('SELECT SUM(size) FROM blobs').fetchone()[0] or 0
+        if total <= self.max_size:
+            return
+        evicted = []
+        for blob_ref, size in self.db.execute('SELECT blob_ref, size FROM blobs '
+                                              'ORDER BY atime'):
+            if total <= self.max_size:
+                break
+            evicted.append(blob_ref)
+            total -= size
+        log.debug('Evicting {0} blobs from the read cache'.format(len(evicted)))
+        self.db.executemany('DELETE FROM blobs WHERE blob_ref = ?',
+                            [(blob_ref,) for blob_ref in evicted])
+        for blob_ref in evicted:
+            try:
+                os.remove(self._path(blob_ref))
+            except OSError:
+                pass
+
+    def invalidate(self, blob_refs=None):
+        """ Remove the given blobRefs (or every blob if None). """
+        with self.lock:
+            with self.db:
+                if blob_refs is None:
+                    blob_refs = [row[0] for row in self.db.execute('SELECT blob_ref FROM blobs')]
+                self.db.executemany('DELETE FROM blobs WHERE blob_ref = ?',
+                                    [(blob_ref,) for blob_ref in blob_refs])
+                for blob_ref in blob_refs:
+                    try:
+                        os.remove(self._path(blob_ref))
+                    except OSError:
+                        pass
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+""" Chunkers, find where to split a file into blobs. """
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+try:
+    from camlipy.rollsum import Rollsum, gear_scan
+except ImportError:
+    # The C extension isn't built, fallback to the NumPy Rollsum
+    from camlipy.rollsum_numpy import Rollsum
+    gear_scan = None
+
+MAX_BLOB_SIZE = 1 << 20
+FIRST_CHUNK_SIZE = 256 << 10
+TOO_SMALL_THRESHOLD = 64 << 10
+# Buffer to detect EOF in advance.
+BUFFER_SIZE = 32 << 10
+# Size of the rollsum window (BUP_WINDOWSIZE in rollsum.h).
+ROLLSUM_WINDOW_SIZE = 64
+# Bits of the splits forced by the max blob size.
+MAX_BLOB_BITS = 20
+
+
+class RollsumChunker(object):
+    """ Default chunker, split the file like Camlistore does (so both
+    end up with the same blobs), using the bup-style Rollsum.
+
+    Args:
+        size: total size of the file
+
+    """
+    name = 'rollsum'
+    # Splits can be computed in parallel (see filewriter.scan_segment)
+    parallel = True
+    # Number of bytes to roll before a split to restore the chunker
+    window_size = ROLLSUM_WINDOW_SIZE
+
+    def __init__(self, size):
+        self.size = size
+        self.rs = Rollsum()
+        # Offset of the next block
+        self.n = 0
+        # Size of the current chunk
+        self.blob_size = 0
+        # Bits at the last offset, used for the last span
+        self.bits = 0
+
+    def restore(self, offset, window):
+        """ Restore the chunker at the split at `offset',
+        `window' being the `window_size' bytes before. """
+        self.rs.scan(window)
+        self.n = offset
+        self.blob_size = 0
+
+    def _split_bits(self, rs_bits):
+        """ Return the bits of the split ending at the current offset,
+        or 0 if the file must not be split here.
+
+        `rs_bits' is the bits of the rollsum split at the current offset,
+        0 if the rollsum doesn't split here.
+
+        """
+        if self.blob_size == MAX_BLOB_SIZE:
+            return MAX_BLOB_BITS
+        # check EOF
+        elif self.n > self.size - BUFFER_SIZE:
+            return 0
+        elif (rs_bits and self.n > FIRST_CHUNK_SIZE and
+                self.blob_size > TOO_SMALL_THRESHOLD):
+            return rs_bits
+        # First chink => 262144 bytes
+        elif self.n == FIRST_CHUNK_SIZE:
+            return 18  # 1 << 18
+        return 0
+
+    def split(self, block, rs_splits=None):
+        """ Return the (offset, bits) splits of the next block of the file,
+        offsets being relative to the block.
+
+        `rs_splits' are the rollsum splits of the block, if already
+        computed (else the block is scanned).
+
+        """
+        if rs_splits is None:
+            rs_splits = self.rs.scan(block)
+        block_size = len(block)
+        rs_splits.append((block_size + 1, 0))
+        rs_index = 0
+        splits = []
+        i = 0
+        while i < block_size:
+            # Next offset where a split may be forced
+            end = i + MAX_BLOB_SIZE - self.blob_size
+            if self.n < FIRST_CHUNK_SIZE:
+                end = min(end, i + FIRST_CHUNK_SIZE - self.n)
+            end = min(end, block_size)
+
+            split, rs_bits = rs_splits[rs_index]
+            if split <= end:
+                rs_index += 1
+            else:
+                split, rs_bits = end, 0
+
+            self.n += split - i
+            self.blob_size += split - i
+            i = split
+
+            self.bits = self._split_bits(rs_bits)
+            if self.bits:
+                self.blob_size = 0
+                splits.append((i, self.bits))
+        return splits
+
+
+def _spread_mask(bits):
+    """ Return a 64 bits mask with `bits' bits set, spread
+    over the 48 most significant bits (like FastCDC masks). """
+    mask = 0
+    for i in range(bits):
+        mask |= 1 << (63 - i * 48 // bits)
+    return mask
+
+
+class FastCDCChunker(object):
+    """ FastCDC chunker, using a gear hash with normalized chunk sizes.
+
+    Faster than the Rollsum, with a tighter chunk size distribution,
+    but files won't be split like Camlistore does.
+
+    Args:
+        size: total size of the file
+        min_size: minimum chunk size
+        normal_size: expected chunk size (must be a power of 2)
+        max_size: maximum chunk size
+
+    """
+    name = 'fastcdc'
+    parallel = False
+    window_size = 0
+
+    def __init__(self, size, min_size=TOO_SMALL_THRESHOLD,
+                 normal_size=FIRST_CHUNK_SIZE, max_size=MAX_BLOB_SIZE):
+        if gear_scan is None:
+            raise Exception('FastCDCChunker requires the camlipy C extension')
+        self.size = size
+        self.min_size = min_size
+        self.normal_size = normal_size
+        self.max_size = max_size
+        normal_bits = normal_size.bit_length() - 1
+        # Harder to split before the normal size, easier after
+        self.mask_s = _spread_mask(normal_bits + 2)
+        self.mask_l = _spread_mask(normal_bits - 2)
+        self.hash = 0
+        # Size of the current chunk
+        self.length = 0
+        self.bits = 0
+
+    def restore(self, offset, window):
+        """ Restore the chunker at the split at `offset'. """
+        self.hash = 0
+        self.length = 0
+
+    def split(self, block, rs_splits=None):
+        """ Return the (offset, bits) splits of the next block of the file,
+        offsets being relative to the block. """
+        splits, self.hash, self.length = gear_scan(block, (self.hash, self.length,
+                                                           self.min_size, self.normal_size,
+                                                           self.max_size, self.mask_s,
+                                                           self.mask_l))
+        return splits
+
+
+CHUNKERS = {'rollsum': RollsumChunker,
+            'fastcdc': FastCDCChunker}
@@ -60,10 +60,10 @@ log.setLevel(logging.INFO)
 
 
 def piped_in():
-    with sys.stdin as stdin:
-        if not stdin.isatty():
-            return stdin.read()
-        return None
+    """ Return stdin if data is piped in, else None. """
+    if not sys.stdin.isatty():
+        return sys.stdin
+    return None
 
 
 def main():
@@ -82,10 +82,11 @@ def main():
     elif arguments['put']:
         # Put sub-command
         if arguments['-']:
-            # Read stdin
-            data = piped_in()
-            br = c.put_blob(data)
-            log.info(br)
+            # Stream stdin, chunked like a file
+            stdin = piped_in()
+            if stdin is not None:
+                br = c.put_file(fileobj=stdin, permanode=arguments['--permanode'])
+                log.info(br)
         for f in arguments['<file>']:
             if os.path.isfile(f):
                 br = c.put_file(f, permanode=arguments['--permanode'])
@@ -9,6 +9,7 @@ import os
 
 from dirtools import Dir
 
+from camlipy.filewriter import put_files
 from camlipy.schema import StaticSet, Directory, apply_stat_info
 
 log = logging.getLogger(__name__)
@@ -24,8 +25,7 @@ def _put_directory(con, path, permanode=False):
     # Don't walk recursively with walk, since we already
     # calling _put_dir recursively.
     root, dirs, files = Dir(path).walk().next()
-    for f in files:
-        static_set_members.append(con.put_file(os.path.join(root, f)))
+    static_set_members.extend(put_files(con, [os.path.join(root, f) for f in files]))
     for d in dirs:
         static_set_members.append(_put_directory(con, os.path.join(root, d), permanode=False))
 
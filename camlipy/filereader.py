@@ -5,13 +5,26 @@
 __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 
 import logging
+import os
+import stat
 import tempfile
+from bisect import bisect_right
+from collections import deque, OrderedDict
+
+from concurrent import futures
 
 from camlipy.schema import Schema, apply_stat_info
 from camlipy.filewriter import Span
 
 log = logging.getLogger(__name__)
 
+# Number of chunks fetched concurrently.
+FETCH_WORKERS = 4
+# Maximum number of chunks fetched ahead, per worker.
+PREFETCH_PER_WORKER = 2
+# Number of chunks kept in memory by SeekableFile.
+CHUNK_CACHE_SIZE = 8
+
 
 class FileReader(object):
     def __init__(self, con, blob_ref):
@@ -22,27 +35,42 @@ class FileReader(object):
         self.blob_ref = blob_ref
         self.spans = None
 
-    def load_spans(self):
-        self.spans = self._load_spans(self.blob_ref)
+    def load_spans(self, workers=FETCH_WORKERS):
+        self.spans = self._load_spans(self.blob_ref, workers)
 
-    def _load_spans(self, blob_ref):
+    def _load_spans(self, blob_ref, workers=FETCH_WORKERS):
+        """ Load the spans tree level by level, the bytes
+        schemas of each level are fetched by `workers' threads. """
         spans = []
-        parts = Schema(self.con, blob_ref).data['parts']
-        for index, part in enumerate(parts):
-            if 'bytesRef' in part:
-                # The associated blobRef => the span
-                blob_ref = parts[index + 1]
-                parts.remove(blob_ref)
-                # If a the blob ref is followed by a bytesRef,
-                # it represents the same Span
-                children = self._load_spans(part['bytesRef'])
-                spans.append(Span(br=blob_ref['blobRef'],
-                                  children=children))
-            elif 'blobRef' in part:
-                # If the blobRef is alone, just append it
-                spans.append(Span(br=part['blobRef'], size=part['size']))
-            else:
-                raise Exception('Part lost: {0}'.format(part))
+        # (bytes schema blobRef, list of the spans it contains) to load
+        level = [(blob_ref, spans)]
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while level:
+                schemas = executor.map(lambda (br, spans): Schema(self.con, br).data, level)
+                next_level = []
+                for (_, level_spans), schema in zip(level, schemas):
+                    parts = schema['parts']
+                    index = 0
+                    while index < len(parts):
+                        part = parts[index]
+                        if 'bytesRef' in part:
+                            # If a the blob ref is followed by a bytesRef,
+                            # it represents the same Span
+                            blob_ref = parts[index + 1]
+                            # The children are loaded with the next level
+                            children = []
+                            next_level.append((part['bytesRef'], children))
+                            level_spans.append(Span(br=blob_ref['blobRef'],
+                                                    children=children,
+                                                    size=part['size'] + blob_ref['size']))
+                            index += 2
+                        elif 'blobRef' in part:
+                            # If the blobRef is alone, just append it
+                            level_spans.append(Span(br=part['blobRef'], size=part['size']))
+                            index += 1
+                        else:
+                            raise Exception('Part lost: {0}'.format(part))
+                level = next_level
         return spans
 
     def spans_to_br(self):
@@ -58,19 +86,204 @@ class FileReader(object):
                     yield sp
                 yield span.br
 
-    def build(self, fileobj=None):
+    def chunks(self):
+        """ Yield the (offset, blobRef, size) of every chunk, in file order. """
+        offset = 0
+        for br, size in self._chunks(self.spans):
+            yield offset, br, size
+            offset += size
+
+    def _chunks(self, spans):
+        for span in spans:
+            if span.single_blob():
+                yield span.br, span.size()
+            else:
+                for chunk in self._chunks(span.children):
+                    yield chunk
+                # The span blob comes after its children
+                yield span.br, span.size() - sum([cs.size() for cs in span.children])
+
+    def build(self, fileobj=None, workers=FETCH_WORKERS):
+        """ Restore the file to `fileobj' (a temp file if None).
+
+        Chunks are fetched by `workers' threads. If `fileobj' is a regular
+        file, it's preallocated and each chunk is written at its offset
+        as soon as it's fetched, else chunks are written in order.
+
+        """
         if fileobj is None:
             fileobj = tempfile.TemporaryFile()
-        for br in self.spans_to_br():
-            blob = self.con.get_blob(br)
-            fileobj.write(blob.read())
-        fileobj.seek(0)
-        if hasattr(fileobj, 'name'):
+        raw = getattr(fileobj, 'file', fileobj)
+        positional = isinstance(raw, file) and stat.S_ISREG(os.fstat(raw.fileno()).st_mode)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            if positional:
+                self._build_positional(raw, executor, workers * PREFETCH_PER_WORKER)
+            else:
+                self._build_ordered(fileobj, executor, workers * PREFETCH_PER_WORKER)
+        try:
+            fileobj.seek(0)
+        except (IOError, AttributeError):
+            # Not seekable (e.g. a pipe)
+            pass
+        # Skip pipes/temp files (named like <fdopen>)
+        if os.path.isfile(getattr(fileobj, 'name', '')):
             apply_stat_info(fileobj.name, Schema(self.con, self.blob_ref).data)
         return fileobj
 
+    def _fetch(self, br):
+        return self.con.get_blob_data(br).read()
+
+    def _build_positional(self, fileobj, executor, window):
+        """ Write each chunk at its offset, in completion order. """
+        base = fileobj.tell()
+        size = sum([span.size() for span in self.spans])
+        fileobj.flush()
+        os.ftruncate(fileobj.fileno(), base + size)
+        pending = {}
+        for offset, br, chunk_size in self.chunks():
+            if len(pending) >= window:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    fileobj.seek(base + pending.pop(future))
+                    fileobj.write(future.result())
+            pending[executor.submit(self._fetch, br)] = offset
+        for future in futures.as_completed(pending):
+            fileobj.seek(base + pending[future])
+            fileobj.write(future.result())
+        fileobj.flush()
+
+    def _build_ordered(self, fileobj, executor, window):
+        """ Write the chunks in order (for non-seekable fileobjs),
+        fetching up to `window' chunks ahead. """
+        pending = deque()
+        for offset, br, chunk_size in self.chunks():
+            if len(pending) >= window:
+                fileobj.write(pending.popleft().result())
+            pending.append(executor.submit(self._fetch, br))
+        while pending:
+            fileobj.write(pending.popleft().result())
+
+
+class SeekableFile(object):
+    """ Read-only, seekable fileobj over a file schema, without
+    downloading the whole file (e.g. to read the end of a big log,
+    or a zip central directory).
+
+    Nested bytes schemas are loaded when an offset they cover is read,
+    each parts list is indexed with the cumulative offsets of the parts,
+    and the chunk containing an offset is found by binary search.
+    The last `cache_size' chunks are kept in memory.
+
+    Args:
+        con: Camlistore instance
+        blob_ref: blobRef of the file schema (or of a permanode)
+        cache_size: number of chunks kept in memory
+
+    """
+    def __init__(self, con, blob_ref, cache_size=CHUNK_CACHE_SIZE):
+        self.con = con
+        self.cache_size = cache_size
+        schema = self.con.get_schema_blob(blob_ref)
+        if schema['camliType'] == 'permanode':
+            blob_metadata = self.con.describe_blob(blob_ref)
+            blob_ref = blob_metadata['permanode']['attr']['camliContent'][0]
+            schema = self.con.get_schema_blob(blob_ref)
+        self.blob_ref = blob_ref
+        self.schema = schema
+        self.root = self._index(schema['parts'])
+        self.size = self.root[2]
+        # Indexes of the bytes schemas already loaded
+        self.nodes = {}
+        self.chunks = OrderedDict()
+        self.pos = 0
+        self.closed = False
+
+    def _index(self, parts):
+        """ Return (parts, offsets, size), offsets being
+        the cumulative offsets of the parts. """
+        offsets = []
+        size = 0
+        for part in parts:
+            offsets.append(size)
+            size += part['size']
+        return parts, offsets, size
+
+    def _node(self, bytes_ref):
+        if bytes_ref not in self.nodes:
+            self.nodes[bytes_ref] = self._index(self.con.get_schema_blob(bytes_ref)['parts'])
+        return self.nodes[bytes_ref]
+
+    def _locate(self, offset):
+        """ Return the (blobRef, offset) of the chunk containing `offset'. """
+        parts, offsets, size = self.root
+        start = 0
+        while 1:
+            index = bisect_right(offsets, offset - start) - 1
+            part = parts[index]
+            start += offsets[index]
+            if 'bytesRef' in part:
+                parts, offsets, size = self._node(part['bytesRef'])
+            elif 'blobRef' in part:
+                return part['blobRef'], start
+            else:
+                raise Exception('Part lost: {0}'.format(part))
+
+    def _chunk(self, blob_ref):
+        if blob_ref in self.chunks:
+            self.chunks[blob_ref] = self.chunks.pop(blob_ref)
+        else:
+            self.chunks[blob_ref] = self.con.get_blob_data(blob_ref).read()
+            if len(self.chunks) > self.cache_size:
+                self.chunks.popitem(last=False)
+        return self.chunks[blob_ref]
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if size < 0 or self.pos + size > self.size:
+            size = max(self.size - self.pos, 0)
+        out = []
+        while size > 0:
+            blob_ref, start = self._locate(self.pos)
+            buf = self._chunk(blob_ref)[self.pos - start:self.pos - start + size]
+            if not buf:
+                raise Exception('Chunk {0} is shorter than its part'.format(blob_ref))
+            out.append(buf)
+            self.pos += len(buf)
+            size -= len(buf)
+        return ''.join(out)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise IOError('Invalid offset: {0}'.format(offset))
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.closed = True
+        self.chunks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_file(con, blob_ref):
+    """ Helper for reading a file from his blobRef
+    without downloading it (see SeekableFile).
+    """
+    return SeekableFile(con, blob_ref)
+
 
-def get_file(con, blob_ref, fileobj=None):
+def get_file(con, blob_ref, fileobj=None, workers=FETCH_WORKERS):
     """ Helper for download a file from his blobRef
     to a fileobj.
     """
@@ -79,5 +292,5 @@ def get_file(con, blob_ref, fileobj=None):
         fileobj = tempfile.NamedTemporaryFile()
 
     file_reader = FileReader(con, blob_ref)
-    file_reader.load_spans()
-    return file_reader.build(fileobj=fileobj)
+    file_reader.load_spans(workers=workers)
+    return file_reader.build(fileobj=fileobj, workers=workers)
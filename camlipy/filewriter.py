@@ -4,35 +4,55 @@
 
 __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 
+import collections
 import logging
+import mmap
 import os
+import stat
 
 from concurrent import futures
 
 import camlipy
-from camlipy.rollsum import Rollsum
-from camlipy.schema import Bytes, File
-
-
-MAX_BLOB_SIZE = 1 << 20
-FIRST_CHUNK_SIZE = 256 << 10
-TOO_SMALL_THRESHOLD = 64 << 10
-# Buffer to detect EOF in advance.
-BUFFER_SIZE = 32 << 10
+from camlipy.cache import file_identity
+from camlipy.chunker import MAX_BLOB_SIZE, FIRST_CHUNK_SIZE, \
+    TOO_SMALL_THRESHOLD, BUFFER_SIZE, ROLLSUM_WINDOW_SIZE, Rollsum, RollsumChunker
+from camlipy.schema import Bytes, File, MAX_STAT_BLOB
+
+
+# Size of the blocks read while chunking.
+READ_BLOCK_SIZE = 1 << 20
+# Size of the segments scanned by each process in parallel mode.
+SEGMENT_SIZE = 64 * READ_BLOCK_SIZE
+# Upload pipeline settings.
+UPLOAD_WORKERS = 2
+MAX_PENDING_CHUNKS = 16
+# Batch size used until the server maxUploadSize is known.
+DEFAULT_BATCH_SIZE = 10 * MAX_BLOB_SIZE
 
 log = logging.getLogger(__name__)
 
 
 class Span(object):
     """ Chunk metadata, used to create the tree,
-    and compute chunk/bytesRef size. """
-    def __init__(self, _from=0, to=0, bits=None, children=[], chunk_cnt=0, br=None, size=None):
+    and compute chunk/bytesRef size.
+
+    A big file is made of millions of spans, so they use __slots__,
+    and the size of the span (including its children) is computed once.
+
+    """
+    __slots__ = ('_from', 'to', 'bits', 'br', 'children', 'chunk_cnt', '_size')
+
+    def __init__(self, _from=0, to=0, bits=None, children=(), chunk_cnt=0, br=None, size=None):
         self._from = _from
         self.to = to
         self.bits = bits
         self.br = br
         self.children = children
         self.chunk_cnt = chunk_cnt
+        if size is None:
+            size = to - _from
+            for cs in children:
+                size += cs._size
         self._size = size
 
     def __repr__(self):
@@ -41,40 +61,177 @@ class Span(object):
                                                                        self._from, self.to,
                                                                        self.bits)
 
+    def to_dict(self):
+        return {'from': self._from, 'to': self.to, 'bits': self.bits,
+                'br': self.br, 'chunk_cnt': self.chunk_cnt,
+                'children': [c.to_dict() for c in self.children]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['from'], data['to'], data['bits'],
+                   [cls.from_dict(c) for c in data['children']],
+                   data['chunk_cnt'], data['br'])
+
     def single_blob(self):
         return not len(self.children)
 
     def size(self):
-        if self._size:
-            return self.size
-        size = self.to - self._from
-        for cs in self.children:
-            size += cs.size()
-        return size
+        return self._size
+
+
+class UploadPipeline(object):
+    """ Hash and upload chunks in the background, while the file is chunked.
+
+    Chunks are hashed by the Camlistore instance HashPool, then grouped
+    in batches of up to maxUploadSize bytes, uploaded by a pool of
+    `upload_workers' threads. At most `max_pending' chunks are waiting
+    to be hashed, and `upload_workers' batches are being uploaded,
+    `put' blocks when theses limits are reached to keep memory bounded.
+
+    Args:
+        con: Camlistore instance
+        cnt: dict updated with uploaded/skipped blobs stats
+
+    """
+    def __init__(self, con, cnt, upload_workers=UPLOAD_WORKERS,
+                 max_pending=MAX_PENDING_CHUNKS):
+        self.con = con
+        self.cnt = cnt
+        self.upload_workers = upload_workers
+        self.max_pending = max_pending
+        self.upload_executor = futures.ThreadPoolExecutor(max_workers=upload_workers)
+        # (span, chunk, hash future) waiting to be hashed
+        self.hashing = collections.deque()
+        # Upload futures
+        self.uploading = collections.deque()
+        # Current batch {blobRef: chunk}
+        self.batch = {}
+        self.batch_size = 0
+
+    def put(self, span, chunk):
+        """ Hash and upload the chunk, `span.br' is set once hashed. """
+        self.hashing.append((span, chunk, self.con.hash_pool.submit(chunk)))
+        while len(self.hashing) > self.max_pending:
+            self._hashed(*self.hashing.popleft())
+
+    def _hashed(self, span, chunk, future):
+        span.br = future.result()
+        self.batch[span.br] = camlipy.Blob(chunk, span.br)
+        self.batch_size += len(chunk)
+        max_upload_size = self.con.max_upload_size or DEFAULT_BATCH_SIZE
+        if self.batch_size + MAX_BLOB_SIZE > max_upload_size:
+            self._upload_batch()
+
+    def _upload_batch(self):
+        if camlipy.DEBUG:
+            log.debug('Upload batch, size:{0}'.format(self.batch_size))
+        self.uploading.append(self.upload_executor.submit(self.con.put_blobs,
+                                                          self.batch.values()))
+        self.batch = {}
+        self.batch_size = 0
+        while len(self.uploading) > self.upload_workers:
+            self._uploaded(self.uploading.popleft())
+
+    def _uploaded(self, future):
+        resp = future.result()
+        for rec in resp['received']:
+            self.cnt['uploaded'] += 1
+            self.cnt['uploaded_size'] += rec['size']
+        for rec in resp['skipped']:
+            self.cnt['skipped'] += 1
+            self.cnt['skipped_size'] += rec['size']
+
+    def close(self):
+        """ Wait for every chunk to be hashed and uploaded. """
+        try:
+            while self.hashing:
+                self._hashed(*self.hashing.popleft())
+            if self.batch:
+                self._upload_batch()
+            while self.uploading:
+                self._uploaded(self.uploading.popleft())
+        finally:
+            self.upload_executor.shutdown()
+
+
+def scan_segment(path, offset, size):
+    """ Scan `size' bytes of the file at `path' starting at `offset',
+    returns the rollsum splits of each block of `READ_BLOCK_SIZE' bytes.
+
+    The rollsum only depends on the last `ROLLSUM_WINDOW_SIZE' bytes,
+    so rolling the bytes right before the segment resynchronizes it
+    with a sequential scan.
+
+    """
+    rs = Rollsum()
+    blocks_splits = []
+    with open(path, 'rb') as fh:
+        window_start = max(0, offset - ROLLSUM_WINDOW_SIZE)
+        fh.seek(window_start)
+        rs.scan(fh.read(offset - window_start))
+        while size > 0:
+            block = fh.read(min(READ_BLOCK_SIZE, size))
+            if not block:
+                break
+            blocks_splits.append(rs.scan(block))
+            size -= len(block)
+    return blocks_splits
 
 
 class FileWriter(object):
-    def __init__(self, con, path=None, fileobj=None):
+    """ Chunk a file and upload its blobs.
+
+    If a `path' to a regular file is given, and `use_mmap' is True,
+    the file is memory-mapped, and chunks are uploaded as buffers
+    of the map, without being copied.
+
+    If a `path' is given and `processes' is set, files bigger than
+    `SEGMENT_SIZE' are scanned in parallel by a pool of `processes'
+    processes, each one scanning a segment of the file (only supported
+    by the RollsumChunker).
+
+    `chunker' is the chunker class (see camlipy.chunker), it defaults
+    to RollsumChunker, that splits files like Camlistore does.
+
+    The `fileobj' doesn't have to be seekable, non-seekable inputs
+    (pipes, sockets...) are streamed, their size is only known at EOF.
+
+    """
+    def __init__(self, con, path=None, fileobj=None, use_mmap=True, processes=None,
+                 chunker=None):
         self.con = con
         self.path = path
+        self.processes = processes
+        # File map, when chunking in mmap mode
+        self.mmap = None
         if path:
             self.reader = open(self.path, 'rb')
             self.size = os.path.getsize(self.path)
+            if use_mmap and self.size > FIRST_CHUNK_SIZE and \
+                    stat.S_ISREG(os.fstat(self.reader.fileno()).st_mode):
+                self.mmap = mmap.mmap(self.reader.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
         else:
             self.reader = fileobj
-            fileobj.seek(0, 2)
-            self.size = fileobj.tell()
-            fileobj.seek(0)
-
-        self.rs = Rollsum()
-        self.blob_size = 0
+            try:
+                fileobj.seek(0, 2)
+                self.size = fileobj.tell()
+                fileobj.seek(0)
+            except (AttributeError, IOError):
+                # Non-seekable input, see `_blocks'
+                self.size = None
+
+        self.chunker = (chunker or RollsumChunker)(self.size)
         # Store Span the instance of the chunk
         self.spans = []
         # Total size
         self.n = 0
+        # Number of chunks, updated when resuming
+        self.chunk_cnt = 0
         # buffer to store the chunk
         self.buf = ''
-        self.buf_spans = {}
+        # Hash/upload the chunks while chunking
+        self.pipeline = None
 
         # To generate the end report.
         self.cnt = {'skipped': 0,
@@ -82,40 +239,195 @@ class FileWriter(object):
                     'uploaded': 0,
                     'uploaded_size': 0}
 
-    def _upload_spans(self, force=False):
-        """ Actually upload/put the blobs. """
-        if len(self.buf_spans) == 10 or force:
-            if camlipy.DEBUG:
-                log.debug('Upload spans')
-            resp = self.con.put_blobs(self.buf_spans.values())
-            self.buf_spans = {}
-            for rec in resp['received']:
-                self.cnt['uploaded'] += 1
-                self.cnt['uploaded_size'] += rec['size']
-            for rec in resp['skipped']:
-                self.cnt['skipped'] += 1
-                self.cnt['skipped_size'] += rec['size']
-
     def upload_last_span(self):
-        """ Empty the current blob buffer, prepare the blob,
-        and add it to the spans buffer (they are uploaded once they
-        are ten blobs in the buffer).
+        """ Empty the current blob buffer, and hand the blob over
+        to the upload pipeline (that will set the span blobRef).
         """
         if camlipy.DEBUG:
             log.debug('Add span to buffer: {0}'.format(self.spans[-1]))
 
         chunk = self.buf
         self.buf = ''
-        blob_ref = camlipy.compute_hash(chunk)
-        self.spans[-1].br = blob_ref
-        self.buf_spans[blob_ref] = chunk
-        executor = futures.ThreadPoolExecutor(max_workers=2)
-        executor.submit(self._upload_spans())
-        executor.shutdown(wait=False)
+        self.pipeline.put(self.spans[-1], chunk)
+
+    def _add_span(self, last, bits, chunk_cnt, eof=False):
+        """ Append the span ending at the current offset to the tree,
+        and upload its data (stored in `self.buf'). """
+        children = ()
+        if not eof:
+            # The tricky part, take spans from the end that have
+            # smaller bits score, slice them and make them children
+            # of the node, that's how we end up with mixed blobRef/bytesRef,
+            # And it keep them ordered by  creating a kind of depth-first graph
+            children_from = len(self.spans)
+
+            while children_from > 0 and \
+                    self.spans[children_from - 1].bits < bits:
+                children_from -= 1
+
+            # Pop them from the end of the stack, every span
+            # is moved once, so it's O(1) amortized per split
+            if children_from < len(self.spans):
+                children = self.spans[children_from:]
+                del self.spans[children_from:]
+
+        current_span = Span(last, self.n, bits, children, chunk_cnt)
+
+        if camlipy.DEBUG:
+            log.debug('Current span: {0}, last:{1}, n:{2}'.format(current_span, last, self.n))
+
+        self.spans.append(current_span)
+        self.upload_last_span()
+
+    def _chunk_data(self, last, pieces, block='', start=0, end=0):
+        """ Return the data of the chunk ending at the current offset.
+
+        In mmap mode, it's a buffer of the map, else the pieces of the chunk
+        read from the previous blocks are joined with block[start:end].
+
+        """
+        if self.mmap is not None:
+            return buffer(self.mmap, last, self.n - last)
+        pieces.append(block[start:end])
+        return ''.join(pieces)
+
+    def _read_full(self, size):
+        """ Read `size' bytes from the reader (less only at EOF),
+        even if the reader returns short reads (like sockets). """
+        pieces = []
+        while size > 0:
+            data = self.reader.read(size)
+            if not data:
+                break
+            pieces.append(data)
+            size -= len(data)
+        return ''.join(pieces)
+
+    def _blocks(self):
+        """ Yield the blocks of `READ_BLOCK_SIZE' bytes of the file.
+
+        If the size of the input is unknown, the next block is read in
+        advance: the chunker never splits in the last `BUFFER_SIZE' bytes,
+        so its size only has to be exact once the last block is read,
+        until then, it's set to the size read so far.
+
+        """
+        if self.mmap is not None:
+            while 1:
+                block = buffer(self.mmap, self.n, READ_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+        elif self.size is not None:
+            while 1:
+                block = self.reader.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+        else:
+            block = self._read_full(READ_BLOCK_SIZE)
+            size = len(block)
+            while block:
+                next_block = ''
+                if len(block) == READ_BLOCK_SIZE:
+                    next_block = self._read_full(READ_BLOCK_SIZE)
+                size += len(next_block)
+                self.chunker.size = size
+                yield block
+                block = next_block
+            self.size = size
+
+    def _read(self, offset, size):
+        """ Return `size' bytes of the file starting at `offset'. """
+        if self.mmap is not None:
+            return self.mmap[offset:offset + size]
+        self.reader.seek(offset)
+        return self.reader.read(size)
+
+    def state(self):
+        """ Return the chunking state at the last split (as a dict
+        that can be serialized to JSON), or None if the file hasn't
+        been split.
+
+        Splits don't depend on the data after them (except for the
+        last span), so if data is later appended to the file, the
+        chunking can be resumed from this state (see `resume').
+
+        """
+        if len(self.spans) < 2:
+            return None
+        # The last span (EOF) is not stable
+        eof_span = self.spans[-1]
+        return {'chunker': self.chunker.name,
+                'offset': eof_span._from,
+                'chunk_cnt': eof_span.chunk_cnt,
+                'spans': [span.to_dict() for span in self.spans[:-1]]}
+
+    def resume(self, state):
+        """ Resume chunking from `state' (see `state'), if the file still
+        starts with the data chunked back then (the file size and the hash
+        of the last chunk are checked).
+
+        Must be called before `chunk', returns True if the state is used.
+
+        """
+        offset = state['offset']
+        spans = [Span.from_dict(span) for span in state['spans']]
+        if not spans or offset > self.size or \
+                state.get('chunker', RollsumChunker.name) != self.chunker.name:
+            return False
+        last_span = spans[-1]
+        last_chunk = self._read(last_span._from, last_span.to - last_span._from)
+        if self.con.get_hash(last_chunk) != last_span.br:
+            log.info('File content changed, chunking from scratch.')
+            self.reader.seek(0)
+            return False
+
+        # Restore the chunker with the bytes before the offset
+        window_start = max(0, offset - self.chunker.window_size)
+        self.chunker.restore(offset, self._read(window_start, offset - window_start))
+
+        self.spans = spans
+        self.n = offset
+        self.chunk_cnt = state['chunk_cnt']
+        if camlipy.DEBUG:
+            log.debug('Resume chunking at offset {0}'.format(offset))
+        return True
+
+    def _parallel_scan(self):
+        """ Scan the file segments in a process pool, yields
+        the rollsum splits of each block, in order. """
+        with futures.ProcessPoolExecutor(max_workers=self.processes) as executor:
+            offsets = iter(xrange(self.n, self.size, SEGMENT_SIZE))
+            # Only keep a few segments ahead to bound memory usage
+            pending = collections.deque()
+            for offset in offsets:
+                pending.append(executor.submit(scan_segment, self.path,
+                                               offset, SEGMENT_SIZE))
+                if len(pending) == 2 * self.processes:
+                    break
+
+            while pending:
+                blocks_splits = pending.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(executor.submit(scan_segment, self.path,
+                                                   offset, SEGMENT_SIZE))
+                for block_splits in blocks_splits:
+                    yield block_splits
 
     def chunk(self):
-        """ Chunk the file with Rollsum to a tree of Spans. """
-        if self.size <= FIRST_CHUNK_SIZE:
+        """ Chunk the file to a tree of Spans.
+
+        The file is read by blocks of `READ_BLOCK_SIZE' bytes, the chunker
+        scans each block (in C) for all its splits at once, the chunks are
+        then sliced out of the blocks.
+
+        In parallel mode, the splits are computed by a process pool
+        (see `scan_segment'), the tree is still built sequentially.
+
+        """
+        if self.size is not None and self.size <= FIRST_CHUNK_SIZE:
             if camlipy.DEBUG:
                 log.debug('Skip chunking, file size lower than first chunk: {0}'.format(self.size))
                 buf = self.reader.read(self.size)
@@ -126,74 +438,53 @@ class FileWriter(object):
 
         if camlipy.DEBUG:
             log.debug('Start chunking, total size: {0}'.format(self.size))
-        chunk_cnt = 0
-        last = 0
-        eof = False
-        bits = 0
-        while 1:
-            c = self.reader.read(1)
-            if c:
-                self.buf += c
-                self.n += 1
-                self.blob_size += 1
-                self.rs.roll(ord(c))
-                on_split = self.rs.on_split()
-
-                bits = 0
-                if self.blob_size == MAX_BLOB_SIZE:
-                    bits = 20
-                # check EOF
-                elif self.n > self.size - BUFFER_SIZE:
-                    continue
-                elif (on_split and self.n > FIRST_CHUNK_SIZE and
-                        self.blob_size > TOO_SMALL_THRESHOLD):
-                    bits = self.rs.bits()
-                # First chink => 262144 bytes
-                elif self.n == FIRST_CHUNK_SIZE:
-                    bits = 18  # 1 << 18
-                else:
-                    continue
-
-                self.blob_size = 0
-
-                # The tricky part, take spans from the end that have
-                # smaller bits score, slice them and make them children
-                # of the node, that's how we end up with mixed blobRef/bytesRef,
-                # And it keep them ordered by  creating a kind of depth-first graph
-                children = []
-                children_from = len(self.spans)
-
-                while children_from > 0 and \
-                        self.spans[children_from - 1].bits < bits:
-                    children_from -= 1
-
-                n_copy = len(self.spans) - children_from
-                if n_copy:
-                    children = self.spans[children_from:]
-                    self.spans = self.spans[:children_from]
-            else:
-                eof = True
-                children = []
-
-            current_span = Span(last, self.n, bits, children, chunk_cnt)
-
-            if camlipy.DEBUG:
-                log.debug('Current span: {0}, last:{1}, n:{2}'.format(current_span, last, self.n))
-
-            self.spans.append(current_span)
-            last = self.n
-            self.upload_last_span()
-
-            chunk_cnt += 1
-
-            if eof:
-                log.debug('EOF')
-                break
+        chunk_cnt = self.chunk_cnt
+        last = self.n
+        # Pieces of the current chunk, from the previous blocks
+        pieces = []
+        blocks_splits = None
+        if self.processes and self.path and self.chunker.parallel and \
+                self.size - self.n > SEGMENT_SIZE:
+            blocks_splits = self._parallel_scan()
+        self.pipeline = UploadPipeline(self.con, self.cnt)
+        for block in self._blocks():
+            block_start = self.n
+            rs_splits = None
+            if blocks_splits is not None:
+                rs_splits = next(blocks_splits)
+            # Start of the current chunk in the block
+            chunk_start = 0
+            for i, bits in self.chunker.split(block, rs_splits):
+                self.n = block_start + i
+
+                self.buf = self._chunk_data(last, pieces, block, chunk_start, i)
+                chunk_start = i
+                pieces = []
+
+                self._add_span(last, bits, chunk_cnt)
+                last = self.n
+                chunk_cnt += 1
+
+            self.n = block_start + len(block)
+            if self.mmap is None and chunk_start < len(block):
+                pieces.append(block[chunk_start:])
+
+        # EOF, the last span contains the remaining data
+        self.buf = self._chunk_data(last, pieces)
+        self._add_span(last, self.chunker.bits, chunk_cnt, eof=True)
+        chunk_cnt += 1
+        log.debug('EOF')
 
         # Upload left chunks
         assert self.n == self.size
 
-        self._upload_spans(force=True)
+        self.pipeline.close()
+        self.chunk_cnt = chunk_cnt
+
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
         return chunk_cnt
 
     def bytes_writer(self, to_bytes=True):
@@ -203,16 +494,26 @@ class FileWriter(object):
         if False, it returns the list of parts (ready to
         be injected in a File schema.)
 
+        The Bytes schemas are serialized bottom-up, and
+        uploaded at the end, in batches.
+
         """
-        return self._bytes_writer(self.spans, to_bytes=to_bytes)
+        schemas = []
+        res = self._bytes_writer(self.spans, schemas, to_bytes=to_bytes)
+        for i in xrange(0, len(schemas), MAX_STAT_BLOB):
+            self.con.put_blobs(schemas[i:i + MAX_STAT_BLOB])
+        return res
 
-    def _bytes_writer(self, spans, to_bytes=True):
+    def _bytes_writer(self, spans, schemas, to_bytes=True):
         """ Actually transform the span in a blobRef/bytesRef tree.
 
         if `to_bytes' is True, returns a Bytes schema,
         if False, it returns the list of parts (ready to
         be injected in a File schema.)
 
+        The serialized Bytes schemas are appended to `schemas',
+        children before their parent.
+
         """
         schema = Bytes(self.con)
         if camlipy.DEBUG:
@@ -227,33 +528,31 @@ class FileWriter(object):
             if len(span.children) == 1 and span.children[0].single_blob():
                 children_size = span.children[0].to - span.children[0]._from
                 schema.add_blob_ref(span.children[0].br, children_size)
-                span.children = []
 
                 if camlipy.DEBUG:
-                    log.debug('Transform this span to blobRef, new span: {0}'.format(span))
+                    log.debug('Transform this span child to blobRef: {0}'.format(span.children[0]))
 
             # Create a new bytesRef if the span has children
             elif len(span.children):
-                children_size = 0
-                for c in span.children:
-                    children_size += c.size()
+                children_size = span.size() - (span.to - span._from)
 
                 if camlipy.DEBUG:
                     log.debug('Embedding a bytesRef')
-                schema.add_bytes_ref(self._bytes_writer(span.children, True), children_size)
+                schema.add_bytes_ref(self._bytes_writer(span.children, schemas, True),
+                                     children_size)
 
             # Make a blobRef with the span data
             schema.add_blob_ref(span.br, span.to - span._from)
-            log.info(schema.json())
-
-        if camlipy.DEBUG:
-            log.debug('Resulting Bytes schema: {0}'.format(schema.json()))
 
         if to_bytes:
-            self.con.put_blobs([schema.json()])
-
-            return camlipy.compute_hash(schema.json())
+            blob = camlipy.Blob(schema.json(), hash_algo=self.con.hash_algo)
+            if camlipy.DEBUG:
+                log.debug('Resulting Bytes schema: {0}'.format(blob.data))
+            schemas.append(blob)
+            return blob.blob_ref
 
+        if camlipy.DEBUG:
+            log.debug('Resulting parts: {0}'.format(schema.data['parts']))
         return schema.data['parts']
 
     def check_spans(self):
@@ -272,25 +571,111 @@ class FileWriter(object):
                 yield span.chunk_cnt
 
 
-def put_file(con, path=None, fileobj=None, permanode=False):
+def put_file(con, path=None, fileobj=None, permanode=False, use_mmap=True,
+             processes=None, incremental=False, chunker=None):
     """ Helper for uploading a file to a Camlistore server.
 
     Specify either a path, or a fileobj.
 
     Can also create a permanode.
 
-    """
-    if path is not None:
-        fileobj = open(path, 'rb')
+    If a path is given, the file is memory-mapped
+    unless `use_mmap' is False, and big files are scanned
+    by `processes' processes if set.
 
-    file_writer = FileWriter(con, fileobj=fileobj)
+    `chunker' is the chunker class used to split the file
+    (see camlipy.chunker), defaults to RollsumChunker.
+
+    If the Camlistore instance has a file cache, and the file
+    hasn't changed since its last upload, it's not uploaded again.
+    If `incremental' is True, the file is expected to be append-only,
+    and only the data appended since the last upload is chunked.
+
+    """
+    identity = None
+    if path is not None and con.file_cache is not None:
+        identity = file_identity(path)
+        cached = con.file_cache.get(con.server, path, identity)
+        if cached is not None:
+            blob_ref, parts = cached
+            log.info('{0} unchanged since last upload: {1}'.format(path, blob_ref))
+            if permanode:
+                return File(con, path).save(parts, permanode=permanode)
+            return blob_ref
+
+    file_writer = FileWriter(con, path=path, fileobj=fileobj,
+                             use_mmap=use_mmap, processes=processes,
+                             chunker=chunker)
+    incremental = incremental and identity is not None
+    if incremental:
+        state = con.file_cache.get_state(con.server, path)
+        if state is not None:
+            file_writer.resume(state)
     file_writer.chunk()
+    if incremental:
+        state = file_writer.state()
+        if state is not None:
+            con.file_cache.set_state(con.server, path, state)
     parts = file_writer.bytes_writer(to_bytes=False)
 
-    file_schema = File(con, path, file_name=fileobj.name)
+    file_schema = File(con, path, file_name=getattr(file_writer.reader, 'name', None))
 
     blob_ref = file_schema.save(parts, permanode=permanode)
 
+    # Only cache the file if it hasn't been updated during the upload
+    if identity is not None and identity == file_identity(path):
+        con.file_cache.set(con.server, path, identity, file_schema.blob_ref, parts)
+
     log.info('Uploaded: {uploaded} blobs, {uploaded_size}bytes. Skipped {skipped} skipped, {skipped_size}bytes.'.format(**file_writer.cnt))
 
     return blob_ref
+
+
+def put_files(con, paths):
+    """ Helper for uploading many files (like the files of a directory),
+    returns the file schema blobRef of each file.
+
+    Files that fit in a single blob are read and hashed in parallel
+    by the Camlistore instance HashPool, and their blobs are uploaded
+    in batches, bigger files are uploaded with `put_file'.
+
+    """
+    blob_refs = {}
+    small_files = []
+    for path in paths:
+        if os.path.getsize(path) > FIRST_CHUNK_SIZE:
+            blob_refs[path] = put_file(con, path=path)
+            continue
+        identity = None
+        if con.file_cache is not None:
+            identity = file_identity(path)
+            cached = con.file_cache.get(con.server, path, identity)
+            if cached is not None:
+                blob_refs[path] = cached[0]
+                continue
+        small_files.append((path, identity))
+
+    # Batches of up to MAX_STAT_BLOB files, or DEFAULT_BATCH_SIZE bytes
+    batches = [[]]
+    batch_size = 0
+    for path, identity in small_files:
+        size = os.path.getsize(path)
+        if len(batches[-1]) == MAX_STAT_BLOB or batch_size + size > DEFAULT_BATCH_SIZE:
+            batches.append([])
+            batch_size = 0
+        batches[-1].append((path, identity))
+        batch_size += size
+
+    for batch in batches:
+        if not batch:
+            continue
+        blobs = con.hash_pool.read_files([path for path, identity in batch])
+        con.put_blobs(blobs)
+        for (path, identity), blob in zip(batch, blobs):
+            parts = [{'blobRef': blob.blob_ref, 'size': blob.size}]
+            file_schema = File(con, path, file_name=os.path.basename(path))
+            blob_refs[path] = file_schema.save(parts)
+            if identity is not None and identity == file_identity(path):
+                con.file_cache.set(con.server, path, identity, blob_refs[path], parts)
+
+    return [blob_refs[path] for path in paths]
@@ -0,0 +1,79 @@
+#include "gear.h"
+#include <stdint.h>
+#include <stdlib.h>
+
+#define GEAR_MIN_BITS (13)
+#define GEAR_MAX_BITS (20)
+
+static uint64_t GEAR[256];
+static int gear_table_ready = 0;
+
+/* Fill the gear table with pseudo-random values (splitmix64),
+ * so the table is the same on every platform. */
+void Gear_init_table(void)
+{
+    uint64_t seed = 0;
+    uint64_t z;
+    int i;
+
+    if (gear_table_ready)
+        return;
+    for (i = 0; i < 256; i++) {
+        seed += 0x9E3779B97F4A7C15ULL;
+        z = seed;
+        z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+        z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+        GEAR[i] = z ^ (z >> 31);
+    }
+    gear_table_ready = 1;
+}
+
+/* Return the bits of a split, used to build the chunks tree
+ * (like Rollsum_bits), from the trailing zeros of the hash. */
+static int Gear_bits(uint64_t hash)
+{
+    int bits = GEAR_MIN_BITS;
+    hash = (hash >> 8) | (1 << (GEAR_MAX_BITS - GEAR_MIN_BITS));
+    while (!(hash & 1)) {
+        hash >>= 1;
+        bits++;
+    }
+    return bits;
+}
+
+/* FastCDC: roll the `len' bytes of `buf' with a gear hash, and store
+ * every split in a newly allocated `*splits' array (to be freed by the
+ * caller), returns the number of splits, or -1 if the allocation failed.
+ *
+ * The first `min_size' bytes of a chunk are skipped, then the hash is
+ * matched against the `mask_s' mask (more bits) until the chunk reaches
+ * `normal_size', and against `mask_l' (less bits) after, to normalize
+ * the chunk sizes, chunks are split at `max_size'. The hash and the
+ * current chunk length are kept in `g' across calls. */
+long Gear_scan_splits(Gear *g, const uint8_t *buf, long len, Rollsum_split **splits)
+{
+    long i, cnt = 0, size = 0;
+    int bits;
+    uint64_t mask;
+
+    *splits = NULL;
+    for (i = 0; i < len; i++) {
+        g->length++;
+        if (g->length <= g->min_size)
+            continue;
+        g->hash = (g->hash << 1) + GEAR[buf[i]];
+        mask = g->length < g->normal_size ? g->mask_s : g->mask_l;
+        if (!(g->hash & mask))
+            bits = Gear_bits(g->hash);
+        else if (g->length >= g->max_size)
+            bits = GEAR_MAX_BITS;
+        else
+            continue;
+
+        if (Rollsum_splits_append(splits, &cnt, &size, i + 1, bits) < 0)
+            return -1;
+        g->hash = 0;
+        g->length = 0;
+    }
+    return cnt;
+}
@@ -0,0 +1,17 @@
+#include <stdint.h>
+#include "rollsum.h"
+
+#ifndef GEAR_H
+#define GEAR_H
+
+typedef struct {
+    uint64_t hash;
+    long length;
+    long min_size, normal_size, max_size;
+    uint64_t mask_s, mask_l;
+} Gear;
+
+void Gear_init_table(void);
+long Gear_scan_splits(Gear *g, const uint8_t *buf, long len, Rollsum_split **splits);
+
+#endif
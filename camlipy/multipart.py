@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+""" Streaming multipart/form-data encoder, used for blob uploads.
+
+The body is generated while it's sent, reading the blobs (strings,
+buffers/memoryviews or fileobjs) a block at a time, so uploading
+a batch doesn't need to load the whole batch in memory.
+
+"""
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import uuid
+
+READ_BLOCK_SIZE = 64 << 10
+
+
+class MultipartEncoder(object):
+    """ File-like multipart/form-data body, with a known length,
+    that can be passed as `data' to requests (the Content-Type must
+    be set to `content_type').
+
+    Args:
+        fields: list of (name, data, size), data being a string,
+            a buffer/memoryview or a fileobj (read from its current position)
+
+    """
+    def __init__(self, fields):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={0}'.format(self.boundary)
+        # List of parts, each part is either a string or a (data, start, size)
+        # tuple read while sending (start being the fileobj position)
+        self.parts = []
+        for name, data, size in fields:
+            self.parts.append('--{0}\r\n'
+                              'Content-Disposition: form-data; name="{1}"; filename="{1}"\r\n'
+                              'Content-Type: application/octet-stream\r\n\r\n'.format(self.boundary,
+                                                                                       name))
+            if isinstance(data, basestring):
+                self.parts.append(data)
+            else:
+                start = None if isinstance(data, (buffer, memoryview)) else data.tell()
+                self.parts.append((data, start, size))
+            self.parts.append('\r\n')
+        self.parts.append('--{0}--\r\n'.format(self.boundary))
+        self.length = sum([len(part) if isinstance(part, basestring) else part[2]
+                           for part in self.parts])
+        # Current part, and offset in the current part
+        self.index = 0
+        self.offset = 0
+
+    def __len__(self):
+        return self.length
+
+    def _read_part(self, part, size):
+        """ Return up to `size' bytes from the current offset of the part. """
+        if isinstance(part, basestring):
+            return part[self.offset:self.offset + size]
+        data, start, part_size = part
+        size = min(size, part_size - self.offset)
+        if isinstance(data, memoryview):
+            return data[self.offset:self.offset + size].tobytes()
+        elif isinstance(data, buffer):
+            return str(buffer(data, self.offset, size))
+        if self.offset == 0:
+            data.seek(start)
+        buf = data.read(size)
+        if size and not buf:
+            raise Exception('Unexpected EOF, {0} bytes missing'.format(part_size - self.offset))
+        return buf
+
+    def read(self, size=-1):
+        """ Return the next `size' bytes of the body (or the rest of the body). """
+        if size < 0:
+            size = self.length
+        out = []
+        while size > 0 and self.index < len(self.parts):
+            buf = self._read_part(self.parts[self.index], size)
+            if not buf:
+                self.index += 1
+                self.offset = 0
+                continue
+            self.offset += len(buf)
+            size -= len(buf)
+            out.append(buf)
+        return ''.join(out)
+
+    def __iter__(self):
+        while 1:
+            buf = self.read(READ_BLOCK_SIZE)
+            if not buf:
+                break
+            yield buf
@@ -9,7 +9,7 @@
 #define BLOB_SIZE (1 << BLOB_BITS)
 
 
-Rollsum *new_Rollsum() {
+Rollsum *new_Rollsum(void) {
     Rollsum *r;
     r = (Rollsum *) malloc(sizeof(Rollsum));
     r->s1 = BUP_WINDOWSIZE * CHAR_OFFSET;
@@ -55,3 +55,58 @@ unsigned int Rollsum_on_split(Rollsum *r)
         return 1;
     return 0;
 }
+
+/* Roll the `len' bytes of `buf' until a split is found,
+ * returns the number of bytes rolled (the split is right after
+ * the last rolled byte), or -1 if the whole buffer has been rolled
+ * without finding a split. */
+long Rollsum_roll_until_split(Rollsum *r, const uint8_t *buf, long len)
+{
+    long i;
+    for (i = 0; i < len; i++) {
+        Rollsum_roll(r, buf[i]);
+        if (Rollsum_on_split(r))
+            return i + 1;
+    }
+    return -1;
+}
+
+/* Append a split to the `*splits' array of `*cnt' splits,
+ * growing it if needed, returns -1 (and frees the array)
+ * if the allocation failed. */
+int Rollsum_splits_append(Rollsum_split **splits, long *cnt, long *size, long offset, int bits)
+{
+    Rollsum_split *tmp;
+
+    if (*cnt == *size) {
+        *size = *size ? *size * 2 : 64;
+        tmp = (Rollsum_split *) realloc(*splits, *size * sizeof(Rollsum_split));
+        if (tmp == NULL) {
+            free(*splits);
+            *splits = NULL;
+            return -1;
+        }
+        *splits = tmp;
+    }
+    (*splits)[*cnt].offset = offset;
+    (*splits)[*cnt].bits = bits;
+    (*cnt)++;
+    return 0;
+}
+
+/* Roll the `len' bytes of `buf', and store every split (the offset
+ * right after the split and its bits) in a newly allocated `*splits'
+ * array (to be freed by the caller), returns the number of splits,
+ * or -1 if the allocation failed. */
+long Rollsum_scan_splits(Rollsum *r, const uint8_t *buf, long len, Rollsum_split **splits)
+{
+    long offset = 0, split, cnt = 0, size = 0;
+
+    *splits = NULL;
+    while ((split = Rollsum_roll_until_split(r, buf + offset, len - offset)) != -1) {
+        offset += split;
+        if (Rollsum_splits_append(splits, &cnt, &size, offset, Rollsum_bits(r)) < 0)
+            return -1;
+    }
+    return cnt;
+}
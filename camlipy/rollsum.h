@@ -10,4 +10,20 @@ typedef struct {
     int wofs;
 } Rollsum;
 
+typedef struct {
+    long offset;
+    int bits;
+} Rollsum_split;
+
+Rollsum *new_Rollsum(void);
+void delete_Rollsum(Rollsum *r);
+void Rollsum_add(Rollsum *r, uint8_t drop, uint8_t add);
+void Rollsum_roll(Rollsum *r, uint8_t ch);
+uint32_t Rollsum_digest(Rollsum *r);
+uint32_t Rollsum_bits(Rollsum *r);
+unsigned int Rollsum_on_split(Rollsum *r);
+long Rollsum_roll_until_split(Rollsum *r, const uint8_t *buf, long len);
+int Rollsum_splits_append(Rollsum_split **splits, long *cnt, long *size, long offset, int bits);
+long Rollsum_scan_splits(Rollsum *r, const uint8_t *buf, long len, Rollsum_split **splits);
+
 #endif
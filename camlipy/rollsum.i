@@ -3,6 +3,115 @@
 %{
 #define SWIG_FILE_WITH_INIT
 #include "rollsum.h"
+#include "gear.h"
+
+/* Get a read-only view of buf, supports both the new buffer protocol
+ * (str, bytearray, memoryview) and old-style buffers (buffer, mmap). */
+static int Rollsum_get_buffer(PyObject *buf, Py_buffer *view) {
+    const void *data;
+    Py_ssize_t len;
+
+    if (PyObject_CheckBuffer(buf))
+        return PyObject_GetBuffer(buf, view, PyBUF_SIMPLE);
+    if (PyObject_AsReadBuffer(buf, &data, &len) < 0)
+        return -1;
+    return PyBuffer_FillInfo(view, buf, (void *) data, len, 1, PyBUF_SIMPLE);
+}
+
+/* Roll buf[start:end] until a split is found, returns the offset
+ * (in buf) right after the split, or -1 if there is no split. */
+PyObject *Rollsum_find_split(Rollsum *r, PyObject *buf, int start, int end) {
+    Py_buffer view;
+    long split;
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    if (start < 0 || start > end || end > view.len) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "invalid buffer range");
+        return NULL;
+    }
+    split = Rollsum_roll_until_split(r, (const uint8_t *) view.buf + start, end - start);
+    PyBuffer_Release(&view);
+    if (split < 0)
+        return PyInt_FromLong(-1);
+    return PyInt_FromLong(start + split);
+}
+
+/* Return a list of (offset, bits) tuples from a splits array (freed). */
+static PyObject *Rollsum_splits_list(Rollsum_split *splits, long cnt) {
+    PyObject *res, *split;
+    long i;
+
+    res = PyList_New(cnt);
+    for (i = 0; res != NULL && i < cnt; i++) {
+        split = Py_BuildValue("(li)", splits[i].offset, splits[i].bits);
+        if (split == NULL) {
+            Py_DECREF(res);
+            res = NULL;
+        } else {
+            PyList_SET_ITEM(res, i, split);
+        }
+    }
+    free(splits);
+    return res;
+}
+
+/* Roll the whole buffer, returns a list of (offset, bits) tuples,
+ * one for each split, offset being the offset (in buf) right after
+ * the split. The GIL is released while rolling, the Rollsum must not
+ * be used by another thread in the meantime. */
+PyObject *Rollsum_scan(Rollsum *r, PyObject *buf) {
+    Py_buffer view;
+    Rollsum_split *splits = NULL;
+    long cnt;
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    cnt = Rollsum_scan_splits(r, (const uint8_t *) view.buf, view.len, &splits);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&view);
+    if (cnt < 0)
+        return PyErr_NoMemory();
+    return Rollsum_splits_list(splits, cnt);
+}
+
+/* FastCDC scan of the whole buffer (see Gear_scan_splits), `state' is
+ * a (hash, length, min_size, normal_size, max_size, mask_s, mask_l)
+ * tuple, returns a ([(offset, bits), ...], hash, length) tuple,
+ * hash and length being the state to use for the next buffer.
+ * The GIL is released while rolling. */
+PyObject *gear_scan(PyObject *buf, PyObject *state) {
+    Py_buffer view;
+    Gear g;
+    unsigned PY_LONG_LONG hash, mask_s, mask_l;
+    Rollsum_split *splits = NULL;
+    long cnt;
+    PyObject *res;
+
+    if (!PyArg_ParseTuple(state, "KllllKK:gear_scan", &hash, &g.length,
+                          &g.min_size, &g.normal_size, &g.max_size,
+                          &mask_s, &mask_l))
+        return NULL;
+    g.hash = hash;
+    g.mask_s = mask_s;
+    g.mask_l = mask_l;
+    Gear_init_table();
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    cnt = Gear_scan_splits(&g, (const uint8_t *) view.buf, view.len, &splits);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&view);
+    if (cnt < 0)
+        return PyErr_NoMemory();
+    res = Rollsum_splits_list(splits, cnt);
+    if (res == NULL)
+        return NULL;
+    return Py_BuildValue("(NKl)", res, (unsigned PY_LONG_LONG) g.hash, g.length);
+}
 %}
 
 typedef struct {
@@ -17,5 +126,9 @@ typedef struct {
     	int digest();
     	int bits();
     	int on_split();
+    	PyObject *find_split(PyObject *buf, int start, int end);
+    	PyObject *scan(PyObject *buf);
     }
 } Rollsum;
+
+PyObject *gear_scan(PyObject *buf, PyObject *state);
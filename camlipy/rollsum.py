@@ -96,9 +96,16 @@ class Rollsum(_object):
     def digest(self): return _rollsum.Rollsum_digest(self)
     def bits(self): return _rollsum.Rollsum_bits(self)
     def on_split(self): return _rollsum.Rollsum_on_split(self)
+    def find_split(self, *args): return _rollsum.Rollsum_find_split(self, *args)
+    def scan(self, *args): return _rollsum.Rollsum_scan(self, *args)
 Rollsum_swigregister = _rollsum.Rollsum_swigregister
 Rollsum_swigregister(Rollsum)
 
+
+def gear_scan(*args):
+  return _rollsum.gear_scan(*args)
+gear_scan = _rollsum.gear_scan
+
 # This file is compatible with both classic and new-style classes.
 
 
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+""" NumPy implementation of the Rollsum, computing the sums of a whole block
+at once with prefix sums instead of rolling each byte.
+
+Used as a fallback when the C extension isn't built, and to analyze
+the splits of a file offline:
+
+>>> offsets, bits = scan_file(open('myfile', 'rb'))
+>>> numpy.diff(offsets)  # distance between splits
+
+"""
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import numpy as np
+
+WINDOW_SIZE = 64
+CHAR_OFFSET = 31
+
+BLOB_BITS = 13
+BLOB_SIZE = 1 << BLOB_BITS
+
+S1_INIT = WINDOW_SIZE * CHAR_OFFSET
+S2_INIT = WINDOW_SIZE * (WINDOW_SIZE - 1) * CHAR_OFFSET
+
+
+def _to_array(data):
+    """ Return the data (str, buffer, bytearray...) as an uint8 array. """
+    if isinstance(data, np.ndarray):
+        return data.astype(np.uint8, copy=False)
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def rolling_sums(data, window=None):
+    """ Return the (s1, s2) arrays of the Rollsum sums after rolling
+    each byte of `data', `window' being the `WINDOW_SIZE' bytes rolled
+    before (the Rollsum starts with a window filled with zeros).
+
+    With x the bytes, and a window of the last 64 bytes:
+    s1 = 64 * 31 + sum(x), and s2 = S2_INIT + sum(weight * x), the weight
+    going from 1 for the last byte to 64 for the oldest one, both are
+    computed from prefix sums of x and index * x.
+
+    """
+    if window is None:
+        window = np.zeros(WINDOW_SIZE, dtype=np.uint8)
+    x = np.concatenate((_to_array(window), _to_array(data))).astype(np.int64)
+    index = np.arange(len(x), dtype=np.int64)
+    # p[k] = sum(x[:k]), q[k] = sum(index[:k] * x[:k])
+    p = np.zeros(len(x) + 1, dtype=np.int64)
+    np.cumsum(x, out=p[1:])
+    q = np.zeros(len(x) + 1, dtype=np.int64)
+    np.cumsum(index * x, out=q[1:])
+
+    j = index[WINDOW_SIZE:]
+    s = p[j + 1] - p[j + 1 - WINDOW_SIZE]
+    w = (j + 1) * s - (q[j + 1] - q[j + 1 - WINDOW_SIZE])
+    return S1_INIT + s, S2_INIT + w
+
+
+def digests(s1, s2):
+    """ Return the Rollsum digests for the given sums arrays. """
+    return ((s1 << 16) | (s2 & 0xffff)) & 0xffffffff
+
+
+def split_mask(s2):
+    """ Return the boolean array of the offsets where the Rollsum splits. """
+    return (s2 & (BLOB_SIZE - 1)) == BLOB_SIZE - 1
+
+
+def split_bits(digest):
+    """ Return the bits of the split for the given digests array
+    (the number of trailing ones after the `BLOB_BITS' + 1 lowest bits). """
+    rsum = np.asarray(digest, dtype=np.int64) >> (BLOB_BITS + 1)
+    bits = np.full(rsum.shape, BLOB_BITS, dtype=np.int64)
+    ones = (rsum & 1) == 1
+    while ones.any():
+        bits += ones
+        rsum >>= 1
+        ones &= (rsum & 1) == 1
+    return bits
+
+
+class Rollsum(object):
+    """ Rollsum, with the same interface as the C Rollsum
+    (see camlipy.rollsum), but `scan' is vectorized with NumPy.
+
+    >>> rs = Rollsum()
+    >>> rs.scan(open('myfile', 'rb').read(1 << 20))
+    [(offset, bits), ...]
+
+    """
+    def __init__(self):
+        self.s1 = S1_INIT
+        self.s2 = S2_INIT
+        # Last WINDOW_SIZE bytes rolled, the oldest first
+        self.window = np.zeros(WINDOW_SIZE, dtype=np.uint8)
+
+    def roll(self, ch):
+        self.scan(chr(ch))
+
+    def digest(self):
+        return int(digests(self.s1, self.s2))
+
+    def on_split(self):
+        return bool(split_mask(self.s2))
+
+    def bits(self):
+        return int(split_bits(self.digest()))
+
+    def scan(self, buf):
+        """ Roll every byte of `buf', returns the (offset, bits) of
+        every split, offset being the offset right after the split. """
+        data = _to_array(buf)
+        if not len(data):
+            return []
+        s1, s2 = rolling_sums(data, self.window)
+        self.s1 = int(s1[-1])
+        self.s2 = int(s2[-1])
+        self.window = np.concatenate((self.window, data))[-WINDOW_SIZE:]
+
+        offsets = np.flatnonzero(split_mask(s2))
+        bits = split_bits(digests(s1[offsets], s2[offsets]))
+        return zip((offsets + 1).tolist(), bits.tolist())
+
+
+def scan_file(fileobj, block_size=1 << 20):
+    """ Scan the whole file by blocks of `block_size' bytes, returns
+    the (offsets, bits) arrays of every Rollsum split (before applying
+    the chunk sizes limits, see camlipy.chunker.RollsumChunker). """
+    rs = Rollsum()
+    offsets = []
+    bits = []
+    n = 0
+    while 1:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        for offset, split in rs.scan(block):
+            offsets.append(n + offset)
+            bits.append(split)
+        n += len(block)
+    return np.array(offsets, dtype=np.int64), np.array(bits, dtype=np.int64)
@@ -2966,6 +2966,115 @@ static swig_module_info swig_module = {swig_types, 3, 0, 0, 0, 0};
 
 #define SWIG_FILE_WITH_INIT
 #include "rollsum.h"
+#include "gear.h"
+
+/* Get a read-only view of buf, supports both the new buffer protocol
+ * (str, bytearray, memoryview) and old-style buffers (buffer, mmap). */
+static int Rollsum_get_buffer(PyObject *buf, Py_buffer *view) {
+    const void *data;
+    Py_ssize_t len;
+
+    if (PyObject_CheckBuffer(buf))
+        return PyObject_GetBuffer(buf, view, PyBUF_SIMPLE);
+    if (PyObject_AsReadBuffer(buf, &data, &len) < 0)
+        return -1;
+    return PyBuffer_FillInfo(view, buf, (void *) data, len, 1, PyBUF_SIMPLE);
+}
+
+/* Roll buf[start:end] until a split is found, returns the offset
+ * (in buf) right after the split, or -1 if there is no split. */
+PyObject *Rollsum_find_split(Rollsum *r, PyObject *buf, int start, int end) {
+    Py_buffer view;
+    long split;
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    if (start < 0 || start > end || end > view.len) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_ValueError, "invalid buffer range");
+        return NULL;
+    }
+    split = Rollsum_roll_until_split(r, (const uint8_t *) view.buf + start, end - start);
+    PyBuffer_Release(&view);
+    if (split < 0)
+        return PyInt_FromLong(-1);
+    return PyInt_FromLong(start + split);
+}
+
+/* Return a list of (offset, bits) tuples from a splits array (freed). */
+static PyObject *Rollsum_splits_list(Rollsum_split *splits, long cnt) {
+    PyObject *res, *split;
+    long i;
+
+    res = PyList_New(cnt);
+    for (i = 0; res != NULL && i < cnt; i++) {
+        split = Py_BuildValue("(li)", splits[i].offset, splits[i].bits);
+        if (split == NULL) {
+            Py_DECREF(res);
+            res = NULL;
+        } else {
+            PyList_SET_ITEM(res, i, split);
+        }
+    }
+    free(splits);
+    return res;
+}
+
+/* Roll the whole buffer, returns a list of (offset, bits) tuples,
+ * one for each split, offset being the offset (in buf) right after
+ * the split. The GIL is released while rolling, the Rollsum must not
+ * be used by another thread in the meantime. */
+PyObject *Rollsum_scan(Rollsum *r, PyObject *buf) {
+    Py_buffer view;
+    Rollsum_split *splits = NULL;
+    long cnt;
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    cnt = Rollsum_scan_splits(r, (const uint8_t *) view.buf, view.len, &splits);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&view);
+    if (cnt < 0)
+        return PyErr_NoMemory();
+    return Rollsum_splits_list(splits, cnt);
+}
+
+/* FastCDC scan of the whole buffer (see Gear_scan_splits), `state' is
+ * a (hash, length, min_size, normal_size, max_size, mask_s, mask_l)
+ * tuple, returns a ([(offset, bits), ...], hash, length) tuple,
+ * hash and length being the state to use for the next buffer.
+ * The GIL is released while rolling. */
+PyObject *gear_scan(PyObject *buf, PyObject *state) {
+    Py_buffer view;
+    Gear g;
+    unsigned PY_LONG_LONG hash, mask_s, mask_l;
+    Rollsum_split *splits = NULL;
+    long cnt;
+    PyObject *res;
+
+    if (!PyArg_ParseTuple(state, "KllllKK:gear_scan", &hash, &g.length,
+                          &g.min_size, &g.normal_size, &g.max_size,
+                          &mask_s, &mask_l))
+        return NULL;
+    g.hash = hash;
+    g.mask_s = mask_s;
+    g.mask_l = mask_l;
+    Gear_init_table();
+
+    if (Rollsum_get_buffer(buf, &view) < 0)
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    cnt = Gear_scan_splits(&g, (const uint8_t *) view.buf, view.len, &splits);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&view);
+    if (cnt < 0)
+        return PyErr_NoMemory();
+    res = Rollsum_splits_list(splits, cnt);
+    if (res == NULL)
+        return NULL;
+    return Py_BuildValue("(NKl)", res, (unsigned PY_LONG_LONG) g.hash, g.length);
+}
 
 
 #include <limits.h>
@@ -3573,6 +3682,74 @@ fail:
 }
 
 
+SWIGINTERN PyObject *_wrap_Rollsum_find_split(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  Rollsum *arg1 = (Rollsum *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  int arg3 ;
+  int arg4 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  int val3 ;
+  int ecode3 = 0 ;
+  int val4 ;
+  int ecode4 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject * obj2 = 0 ;
+  PyObject * obj3 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OOOO:Rollsum_find_split",&obj0,&obj1,&obj2,&obj3)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Rollsum, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Rollsum_find_split" "', argument " "1"" of type '" "Rollsum *""'"); 
+  }
+  arg1 = (Rollsum *)(argp1);
+  arg2 = obj1;
+  ecode3 = SWIG_AsVal_int(obj2, &val3);
+  if (!SWIG_IsOK(ecode3)) {
+    SWIG_exception_fail(SWIG_ArgError(ecode3), "in method '" "Rollsum_find_split" "', argument " "3"" of type '" "int""'");
+  } 
+  arg3 = (int)(val3);
+  ecode4 = SWIG_AsVal_int(obj3, &val4);
+  if (!SWIG_IsOK(ecode4)) {
+    SWIG_exception_fail(SWIG_ArgError(ecode4), "in method '" "Rollsum_find_split" "', argument " "4"" of type '" "int""'");
+  } 
+  arg4 = (int)(val4);
+  result = (PyObject *)Rollsum_find_split(arg1,arg2,arg3,arg4);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_Rollsum_scan(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  Rollsum *arg1 = (Rollsum *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OO:Rollsum_scan",&obj0,&obj1)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Rollsum, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Rollsum_scan" "', argument " "1"" of type '" "Rollsum *""'"); 
+  }
+  arg1 = (Rollsum *)(argp1);
+  arg2 = obj1;
+  result = (PyObject *)Rollsum_scan(arg1,arg2);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 SWIGINTERN PyObject *Rollsum_swigregister(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
   PyObject *obj;
   if (!PyArg_ParseTuple(args,(char*)"O:swigregister", &obj)) return NULL;
@@ -3580,6 +3757,25 @@ SWIGINTERN PyObject *Rollsum_swigregister(PyObject *SWIGUNUSEDPARM(self), PyObje
   return SWIG_Py_Void();
 }
 
+SWIGINTERN PyObject *_wrap_gear_scan(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  PyObject *arg1 = (PyObject *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OO:gear_scan",&obj0,&obj1)) SWIG_fail;
+  arg1 = obj0;
+  arg2 = obj1;
+  result = (PyObject *)gear_scan(arg1,arg2);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 static PyMethodDef SwigMethods[] = {
 	 { (char *)"SWIG_PyInstanceMethod_New", (PyCFunction)SWIG_PyInstanceMethod_New, METH_O, NULL},
 	 { (char *)"Rollsum_s1_set", _wrap_Rollsum_s1_set, METH_VARARGS, NULL},
@@ -3597,7 +3793,10 @@ static PyMethodDef SwigMethods[] = {
 	 { (char *)"Rollsum_digest", _wrap_Rollsum_digest, METH_VARARGS, NULL},
 	 { (char *)"Rollsum_bits", _wrap_Rollsum_bits, METH_VARARGS, NULL},
 	 { (char *)"Rollsum_on_split", _wrap_Rollsum_on_split, METH_VARARGS, NULL},
+	 { (char *)"Rollsum_find_split", _wrap_Rollsum_find_split, METH_VARARGS, NULL},
+	 { (char *)"Rollsum_scan", _wrap_Rollsum_scan, METH_VARARGS, NULL},
 	 { (char *)"Rollsum_swigregister", Rollsum_swigregister, METH_VARARGS, NULL},
+	 { (char *)"gear_scan", _wrap_gear_scan, METH_VARARGS, NULL},
 	 { NULL, NULL, 0, NULL }
 };
 
@@ -15,7 +15,6 @@ try:
 except ImportError:
     pass
 
-import requests
 import ujson as json
 
 import camlipy
@@ -95,7 +94,7 @@ class Schema(object):
 
         # If it's an existing schema then we load it
         if blob_ref is not None:
-            self.data = self.con.get_blob(self.blob_ref)
+            self.data = self.con.get_schema_blob(self.blob_ref)
 
             if camlipy.DEBUG:
                 log.debug('Loading existing schema: {0}'.format(self.data))
@@ -104,9 +103,9 @@ class Schema(object):
         """ Call the signature server to sign json. """
         camli_signer = self.con.conf['signing']['publicKeyBlobRef']
         self.data.update({'camliSigner': camli_signer})
-        r = requests.post(self.con.url_signHandler,
-                          data={'json': json.dumps(data)},
-                          auth=self.con.auth)
+        r = self.con.session.post(self.con.url_signHandler,
+                                  data={'json': json.dumps(data)},
+                                  auth=self.con.auth)
         r.raise_for_status()
         return r.text
 
@@ -215,7 +214,7 @@ class Permanode(Schema):
         claim = 'camli/search/claims?permanode={0}'.format(self.blob_ref)
         claim_url = urlparse.urljoin(self.con.url_searchRoot, claim)
 
-        r = requests.get(claim_url, auth=self.con.auth)
+        r = self.con.session.get(claim_url, auth=self.con.auth)
         r.raise_for_status()
 
         claims = []
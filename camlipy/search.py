@@ -7,8 +7,6 @@ __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 import logging
 import urlparse
 
-import requests
-
 log = logging.getLogger(__name__)
 
 
@@ -37,6 +35,6 @@ class Search(object):
         params = self.search_params.copy()
         params.update({'attr': attr, 'value': value,
                        'fuzzy': fuzzy, 'max': max})
-        r = requests.get(self.search_url, params=params)
+        r = self.con.session.get(self.search_url, params=params)
 
         return r.json()
@@ -9,7 +9,7 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 import camlipy
-from camlipy import Camlistore, compute_hash
+from camlipy import Camlistore
 
 camlipy.DEBUG = True
 CAMLIPY_SERVER = os.environ.get('CAMLIPY_SERVER', 'http://localhost:3179/')
@@ -20,4 +20,4 @@ CAMLIPY_CAMLISTORE_PATH = os.environ.get('CAMLIPY_CAMLISTORE_PATH',
 class CamliPyTestCase(unittest.TestCase):
     def setUp(self):
         self.server = Camlistore(CAMLIPY_SERVER, auth=('', 'pass3179'))
-        self.compute_hash = compute_hash
+        self.compute_hash = self.server.get_hash
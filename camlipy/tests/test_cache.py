@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import unittest
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+from camlipy.cache import FileCache, BlobCache, ReadCache, file_identity
+from camlipy import compute_hash
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = FileCache(os.path.join(self.tmpdir, 'cache.db'))
+        self.path = os.path.join(self.tmpdir, 'testfile')
+        with open(self.path, 'wb') as fh:
+            fh.write(os.urandom(4096))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testFileCache(self):
+        server = 'http://localhost:3179/'
+        parts = [{'blobRef': 'sha1-0', 'size': 4096}]
+        identity = file_identity(self.path)
+        self.assertEqual(self.cache.get(server, self.path, identity), None)
+
+        self.cache.set(server, self.path, identity, 'sha1-1', parts)
+        self.assertEqual(self.cache.get(server, self.path, identity), ('sha1-1', parts))
+        self.assertEqual(self.cache.get('http://other:3179/', self.path, identity), None)
+
+        # The file is updated
+        with open(self.path, 'ab') as fh:
+            fh.write('data')
+        self.assertEqual(self.cache.get(server, self.path, file_identity(self.path)), None)
+
+        self.cache.invalidate(server, self.path)
+        self.assertEqual(self.cache.get(server, self.path, identity), None)
+
+
+class TestBlobCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = BlobCache(os.path.join(self.tmpdir, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testBlobCache(self):
+        server = 'http://localhost:3179/'
+        blobs = [{'blobRef': 'sha1-{0}'.format(i), 'size': i} for i in xrange(1200)]
+        blob_refs = [blob['blobRef'] for blob in blobs]
+        self.assertEqual(self.cache.get(server, blob_refs), {})
+
+        self.cache.add(server, blobs[:1000])
+        known = self.cache.get(server, blob_refs)
+        self.assertEqual(known, dict((blob['blobRef'], blob['size']) for blob in blobs[:1000]))
+        self.assertEqual(self.cache.get('http://other:3179/', blob_refs), {})
+
+        self.cache.invalidate(server, blob_refs[:600])
+        self.assertEqual(sorted(self.cache.get(server, blob_refs)), sorted(blob_refs[600:1000]))
+
+        self.cache.invalidate(server)
+        self.assertEqual(self.cache.get(server, blob_refs), {})
+
+
+class TestReadCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ReadCache(os.path.join(self.tmpdir, 'blobs'), max_size=10 << 10)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testReadCache(self):
+        blobs = [os.urandom(4 << 10) for i in xrange(3)]
+        blob_refs = [compute_hash(blob) for blob in blobs]
+        self.assertEqual(self.cache.get(blob_refs[0]), None)
+
+        for blob, blob_ref in zip(blobs, blob_refs)[:2]:
+            self.cache.put(blob_ref, StringIO(blob))
+        self.assertEqual(self.cache.get(blob_refs[0]).read(), blobs[0])
+
+        # The least recently used blob is evicted
+        self.cache.put(blob_refs[2], StringIO(blobs[2]))
+        self.assertEqual(self.cache.get(blob_refs[1]), None)
+        self.assertEqual(self.cache.get(blob_refs[0]).read(), blobs[0])
+        self.assertEqual(self.cache.get(blob_refs[2]).read(), blobs[2])
+
+        # Blobs are checked before being added
+        self.assertRaises(Exception, self.cache.put, blob_refs[1], StringIO(blobs[0]))
+        self.assertEqual(self.cache.get(blob_refs[1]), None)
+
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get(blob_refs[0]), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,11 @@ __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 
 import unittest
 import os
+import shutil
 import tempfile
 
-from camlipy.tests import CamliPyTestCase
+from camlipy import Camlistore, Blob, HashPool, compute_hash, check_hash
+from camlipy.tests import CamliPyTestCase, CAMLIPY_SERVER
 
 
 class TestCamliPy(CamliPyTestCase):
@@ -39,6 +41,16 @@ class TestCamliPy(CamliPyTestCase):
         test_blob_file.seek(0)
         self.assertEqual(resp['received'], [{'blobRef': self.compute_hash(test_blob_file.read()), 'size': 4096}])
 
+    def testPutBlobObject(self):
+        test_blob_str = os.urandom(4096)
+        test_blob = Blob(test_blob_str, hash_algo=self.server.hash_algo)
+        self.assertEqual(test_blob.size, 4096)
+        self.assertEqual(test_blob.blob_ref, self.compute_hash(test_blob_str))
+
+        resp = self.server.put_blobs([test_blob])
+        self.assertEqual(resp['received'], [{'blobRef': test_blob.blob_ref, 'size': 4096}])
+        self.assertEqual(self.server.put_blob(test_blob), test_blob.blob_ref)
+
     def testPutBlobsBiggerThanMaxUpload(self):
         max_upload_size = self.server._stat()['maxUploadSize']
         nb_blobs = 10000
@@ -48,6 +60,35 @@ class TestCamliPy(CamliPyTestCase):
         resp = self.server.put_blobs(test_blobs)
         self.assertEqual(test_blobs_br, set([r['blobRef'] for r in resp['received']]))
 
+    def testPutBlobsConcurrently(self):
+        max_upload_size = self.server._stat()['maxUploadSize']
+        test_blobs = [os.urandom(1 << 20) for i in xrange(max_upload_size * 3 / (1 << 20))]
+        test_blobs_br = set([self.compute_hash(b) for b in test_blobs])
+        resp = self.server.put_blobs(test_blobs, upload_workers=4)
+        self.assertEqual(test_blobs_br, set([r['blobRef'] for r in resp['received']]))
+        self.assertEqual(test_blobs_br, set(resp['success']))
+
+    def testPutBlobsWithBlobCache(self):
+        tmpdir = tempfile.mkdtemp()
+        server = Camlistore(CAMLIPY_SERVER, auth=('', 'pass3179'),
+                            blob_cache=os.path.join(tmpdir, 'blobs.db'))
+        test_blobs = [os.urandom(4096) for i in xrange(10)]
+        resp = server.put_blobs(test_blobs)
+        self.assertEqual(len(resp['received']), 10)
+
+        # Every blob is known, nothing is stated nor uploaded
+        server._stat = None
+        resp = server.put_blobs(test_blobs)
+        self.assertEqual(len(resp['skipped']), 10)
+        self.assertEqual(set(resp['success']), set([self.compute_hash(b) for b in test_blobs]))
+
+        server.blob_cache.invalidate(server.server)
+        del server._stat
+        resp = server.put_blobs(test_blobs)
+        self.assertEqual(len(resp['skipped']), 10)
+        server.close()
+        shutil.rmtree(tmpdir)
+
     def testGetBlob(self):
         data_len = (1024 << 10) + (4 << 10)
         blob_data = os.urandom(data_len)
@@ -58,6 +99,32 @@ class TestCamliPy(CamliPyTestCase):
         fileobj.seek(0)
         self.assertEqual(fileobj.read(), blob_data)
 
+    def testGetBlobSchema(self):
+        schema_br = self.server.put_blob('{"camliVersion": 1, "camliType": "bytes", "parts": []}')
+        self.assertEqual(self.server.get_blob(schema_br),
+                         {'camliVersion': 1, 'camliType': 'bytes', 'parts': []})
+        self.assertEqual(self.server.get_schema_blob(schema_br)['camliType'], 'bytes')
+        self.assertEqual(self.server.get_blob_data(schema_br).read()[:16], '{"camliVersion":')
+
+        # JSON data that isn't a schema
+        json_br = self.server.put_blob('{"key": "value"}')
+        self.assertEqual(self.server.get_blob(json_br).read(), '{"key": "value"}')
+        self.assertRaises(Exception, self.server.get_schema_blob, json_br)
+
+    def testGetBlobWithReadCache(self):
+        tmpdir = tempfile.mkdtemp()
+        server = Camlistore(CAMLIPY_SERVER, auth=('', 'pass3179'),
+                            read_cache=os.path.join(tmpdir, 'blobs'))
+        blob_data = os.urandom(4096)
+        blob_br = server.put_blob(blob_data)
+        self.assertEqual(server.get_blob(blob_br).read(), blob_data)
+
+        # Cached blobs are not fetched again
+        server.session = None
+        self.assertEqual(server.get_blob(blob_br).read(), blob_data)
+        server.read_cache.close()
+        shutil.rmtree(tmpdir)
+
     def testStat(self):
         test_blob_str = os.urandom(4096)
         blob_br = self.compute_hash(test_blob_str)
@@ -67,11 +134,56 @@ class TestCamliPy(CamliPyTestCase):
         stat_resp = self.server._stat([blob_br])
         self.assertEqual(stat_resp['stat'][0], {'blobRef': blob_br, 'size': 4096})
 
+    def testStatPages(self):
+        test_blobs = [os.urandom(64) for i in xrange(2500)]
+        resp = self.server.put_blobs(test_blobs[:1500])
+        self.assertEqual(len(resp['received']), 1500)
+
+        stat_resp = self.server._stat([self.compute_hash(b) for b in test_blobs])
+        self.assertEqual(set([s['blobRef'] for s in stat_resp['stat']]),
+                         set(resp['success']))
+        self.assertTrue(stat_resp['uploadUrl'])
+
     def testPutBlobHelper(self):
         test_blob_str = os.urandom(4096)
         expected_br = self.compute_hash(test_blob_str)
         br = self.server.put_blob(test_blob_str)
         self.assertEqual(expected_br, br)
 
+
+class TestHashPool(unittest.TestCase):
+
+    def testHashPool(self):
+        hash_pool = HashPool(workers=4)
+        test_blobs = [Blob(os.urandom(4096)) for i in xrange(10)]
+        test_blobs.append(Blob(os.urandom(4096), 'sha1-known'))
+        hash_pool.hash_blobs(test_blobs)
+        for blob in test_blobs[:-1]:
+            self.assertEqual(blob.blob_ref, compute_hash(blob.data))
+        self.assertEqual(test_blobs[-1].blob_ref, 'sha1-known')
+
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(os.urandom(4096))
+        test_file.flush()
+        test_file.seek(0)
+        blob, = hash_pool.read_files([test_file.name])
+        self.assertEqual(blob.blob_ref, compute_hash(test_file))
+        self.assertEqual(blob.size, 4096)
+        hash_pool.shutdown()
+
+    def testHashAlgo(self):
+        sha1_br = compute_hash('hello')
+        sha224_br = compute_hash('hello', hash_algo='sha224')
+        self.assertTrue(sha1_br.startswith('sha1-'))
+        self.assertTrue(sha224_br.startswith('sha224-'))
+        self.assertTrue(check_hash(sha1_br))
+        self.assertTrue(check_hash(sha224_br))
+        self.assertFalse(check_hash('sha224-' + sha1_br[5:]))
+        self.assertFalse(check_hash('md5-' + sha1_br[5:]))
+
+        hash_pool = HashPool(hash_algo='sha224')
+        self.assertEqual(hash_pool.submit('hello').result(), sha224_br)
+        hash_pool.shutdown()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import os
+
+from camlipy.chunker import RollsumChunker, FastCDCChunker, \
+    MAX_BLOB_SIZE, TOO_SMALL_THRESHOLD
+
+
+def _split(chunker, buf, block_size):
+    splits = []
+    for offset in range(0, len(buf), block_size):
+        for split, bits in chunker.split(buffer(buf, offset, block_size)):
+            splits.append((offset + split, bits))
+    return splits
+
+
+def test_chunkers_across_blocks():
+    buf = os.urandom(5 << 20)
+    for chunker in (RollsumChunker, FastCDCChunker):
+        splits = _split(chunker(len(buf)), buf, len(buf))
+        assert splits
+        # The state is carried across blocks
+        assert _split(chunker(len(buf)), buf, 100000) == splits
+
+
+def test_fastcdc_chunk_sizes():
+    buf = os.urandom(5 << 20)
+    chunker = FastCDCChunker(len(buf))
+    last = 0
+    for split, bits in _split(chunker, buf, 1 << 20):
+        assert TOO_SMALL_THRESHOLD < split - last <= MAX_BLOB_SIZE
+        assert bits
+        last = split
+
+    # Inserting data only changes the splits around it
+    splits = set((split + 10, bits) for split, bits in _split(FastCDCChunker(len(buf)), buf, 1 << 20))
+    shifted = set(_split(FastCDCChunker(len(buf) + 10), os.urandom(10) + buf, 1 << 20))
+    assert len(splits & shifted) >= len(splits) - 2
@@ -5,6 +5,8 @@ __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 import unittest
 import os
 import logging
+import hashlib
+import subprocess
 import tempfile
 
 from camlipy.tests import CamliPyTestCase
@@ -37,6 +39,10 @@ class TestFileWriterAndFileReader(CamliPyTestCase):
         file_reader = FileReader(self.server, blob_ref)
         file_reader.load_spans()
 
+        # Spans sizes include their children
+        self.assertEqual(sum([span.size() for span in file_writer.spans]), 52428800)
+        self.assertEqual(sum([span.size() for span in file_reader.spans]), 52428800)
+
         out = file_reader.build()
 
         test_blob.seek(0)
@@ -55,6 +61,137 @@ class TestFileWriterAndFileReader(CamliPyTestCase):
         self.assertEqual(file_writer2.cnt['uploaded'], 0)
         self.assertEqual(file_writer2.cnt['uploaded_size'], 0)
 
+    def testMmapFile(self):
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(os.urandom(5 << 20))
+        test_file.flush()
+        test_file.seek(0)
+        blob_hash = self.compute_hash(test_file)
+
+        file_writer = FileWriter(self.server, path=test_file.name)
+        self.assertTrue(file_writer.mmap is not None)
+        file_writer.chunk()
+        blob_ref = file_writer.bytes_writer()
+
+        file_reader = FileReader(self.server, blob_ref)
+        file_reader.load_spans()
+        out = file_reader.build()
+        self.assertEqual(self.compute_hash(out), blob_hash)
+
+        # The same file chunked without mmap gives the same blobs
+        file_writer2 = FileWriter(self.server, path=test_file.name, use_mmap=False)
+        file_writer2.chunk()
+        self.assertEqual(file_writer2.bytes_writer(), blob_ref)
+        self.assertEqual(file_writer2.cnt['uploaded'], 0)
+
+    def testParallelChunking(self):
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(os.urandom(150 << 20))
+        test_file.flush()
+
+        file_writer = FileWriter(self.server, path=test_file.name)
+        file_writer.chunk()
+
+        file_writer2 = FileWriter(self.server, path=test_file.name, processes=4)
+        file_writer2.chunk()
+
+        self.assertEqual(file_writer2.bytes_writer(), file_writer.bytes_writer())
+        self.assertEqual(file_writer2.cnt['uploaded'], 0)
+
+    def testResumeAppendedFile(self):
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(os.urandom(5 << 20))
+        test_file.flush()
+
+        file_writer = FileWriter(self.server, path=test_file.name)
+        file_writer.chunk()
+        state = file_writer.state()
+
+        test_file.write(os.urandom(3 << 20))
+        test_file.flush()
+
+        file_writer2 = FileWriter(self.server, path=test_file.name)
+        file_writer2.chunk()
+
+        file_writer3 = FileWriter(self.server, path=test_file.name)
+        self.assertTrue(file_writer3.resume(state))
+        file_writer3.chunk()
+
+        self.assertEqual(file_writer3.bytes_writer(), file_writer2.bytes_writer())
+        self.assertEqual(file_writer3.cnt['uploaded'], 0)
+        self.assertTrue(file_writer3.cnt['skipped_size'] < file_writer2.cnt['skipped_size'])
+
+    def testStreamPipe(self):
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(os.urandom(5 << 20))
+        test_file.flush()
+
+        file_writer = FileWriter(self.server, path=test_file.name)
+        file_writer.chunk()
+
+        # A pipe isn't seekable, so the size is unknown
+        cat = subprocess.Popen(['cat', test_file.name], stdout=subprocess.PIPE)
+        file_writer2 = FileWriter(self.server, fileobj=cat.stdout)
+        self.assertEqual(file_writer2.size, None)
+        file_writer2.chunk()
+        cat.wait()
+
+        self.assertEqual(file_writer2.size, 5 << 20)
+        self.assertEqual(file_writer2.bytes_writer(), file_writer.bytes_writer())
+        self.assertEqual(file_writer2.cnt['uploaded'], 0)
+
+    def testBuildParallel(self):
+        data = os.urandom(10 << 20)
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(data)
+        test_file.flush()
+
+        file_writer = FileWriter(self.server, path=test_file.name)
+        file_writer.chunk()
+        blob_ref = file_writer.bytes_writer()
+
+        file_reader = FileReader(self.server, blob_ref)
+        file_reader.load_spans(workers=8)
+        chunks = list(file_reader.chunks())
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][0] + chunks[-1][2], len(data))
+
+        # The bytes schemas of a level are loaded concurrently, in order
+        file_reader2 = FileReader(self.server, blob_ref)
+        file_reader2.load_spans(workers=1)
+        self.assertEqual(list(file_reader2.chunks()), chunks)
+
+        # Chunks are written at their offsets in a regular file
+        out = file_reader.build(tempfile.NamedTemporaryFile(), workers=8)
+        self.assertEqual(out.read(), data)
+
+        # And in order in a non-seekable fileobj
+        md5sum = subprocess.Popen(['md5sum'], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, close_fds=True)
+        file_reader.build(md5sum.stdin, workers=8)
+        md5sum.stdin.close()
+        self.assertEqual(md5sum.stdout.read().split()[0], hashlib.md5(data).hexdigest())
+        md5sum.wait()
+
+    def testSeekableFile(self):
+        data = os.urandom(10 << 20)
+        test_file = tempfile.NamedTemporaryFile()
+        test_file.write(data)
+        test_file.flush()
+
+        blob_ref = self.server.put_file(test_file.name)
+
+        fileobj = self.server.open_file(blob_ref)
+        self.assertEqual(fileobj.size, len(data))
+        fileobj.seek(-1000, os.SEEK_END)
+        self.assertEqual(fileobj.read(), data[-1000:])
+        for offset, size in [(0, 100), (3 << 20, 2 << 20), ((1 << 20) - 10, 20), (len(data), 10)]:
+            fileobj.seek(offset)
+            self.assertEqual(fileobj.read(size), data[offset:offset + size])
+            self.assertEqual(fileobj.tell(), min(offset + size, len(data)))
+        fileobj.seek(0)
+        self.assertEqual(fileobj.read(), data)
+
 
 if __name__ == '__main__':
     unittest.main()
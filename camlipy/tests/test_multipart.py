@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
+
+import cgi
+import os
+import tempfile
+from cStringIO import StringIO
+
+from camlipy.multipart import MultipartEncoder
+
+
+def test_multipart_encoder():
+    data = os.urandom(100000)
+    fileobj = tempfile.TemporaryFile()
+    fileobj.write('header' + data)
+    fileobj.seek(6)
+    enc = MultipartEncoder([('str', data, len(data)),
+                            ('buffer', buffer(data), len(data)),
+                            ('memoryview', memoryview(data), len(data)),
+                            ('fileobj', fileobj, len(data))])
+    body = ''.join(enc)
+    assert len(body) == len(enc)
+
+    form = cgi.FieldStorage(fp=StringIO(body),
+                            environ={'REQUEST_METHOD': 'POST',
+                                     'CONTENT_TYPE': enc.content_type,
+                                     'CONTENT_LENGTH': str(len(body))})
+    for name in ('str', 'buffer', 'memoryview', 'fileobj'):
+        assert form[name].filename == name
+        assert form[name].value == data
@@ -5,6 +5,11 @@ __author__ = 'Thomas Sileo (thomas@trucsdedev.com)'
 import random
 from camlipy.rollsum import Rollsum
 
+try:
+    from camlipy import rollsum_numpy
+except ImportError:
+    rollsum_numpy = None
+
 WINDOW_SIZE = 64
 
 
@@ -33,6 +38,73 @@ def test_rollsum():
     assert sum3a == sum3b
 
 
+def test_rollsum_find_split():
+    buf = ''.join([chr(random.randint(0, 255)) for i in range(100000)])
+
+    rs = Rollsum()
+    splits = []
+    for i, c in enumerate(buf):
+        rs.roll(ord(c))
+        if rs.on_split():
+            splits.append((i + 1, rs.bits()))
+
+    rs2 = Rollsum()
+    splits2 = []
+    offset = 0
+    while 1:
+        offset = rs2.find_split(buf, offset, len(buf))
+        if offset == -1:
+            break
+        splits2.append((offset, rs2.bits()))
+
+    assert splits == splits2
+    assert rs.digest() == rs2.digest()
+
+
+def test_rollsum_scan():
+    buf = ''.join([chr(random.randint(0, 255)) for i in range(100000)])
+
+    rs = Rollsum()
+    splits = []
+    for i, c in enumerate(buf):
+        rs.roll(ord(c))
+        if rs.on_split():
+            splits.append((i + 1, rs.bits()))
+
+    assert Rollsum().scan(buf) == splits
+    assert Rollsum().scan(bytearray(buf)) == splits
+    assert Rollsum().scan(memoryview(buf)) == splits
+
+    # The state is carried across buffers
+    rs2 = Rollsum()
+    splits2 = []
+    for offset in range(0, len(buf), 30000):
+        for split, bits in rs2.scan(buffer(buf, offset, 30000)):
+            splits2.append((offset + split, bits))
+
+    assert splits == splits2
+    assert rs.digest() == rs2.digest()
+
+
+def test_rollsum_numpy():
+    if rollsum_numpy is None:
+        return
+    buf = ''.join([chr(random.randint(0, 255)) for i in range(100000)])
+
+    rs = Rollsum()
+    rs2 = rollsum_numpy.Rollsum()
+    for offset in range(0, len(buf), 30000):
+        block = buffer(buf, offset, 30000)
+        assert rs.scan(block) == rs2.scan(block)
+        assert rs.digest() == rs2.digest()
+
+    for c in buf[:1000]:
+        rs.roll(ord(c))
+        rs2.roll(ord(c))
+        assert rs.digest() == rs2.digest()
+        assert rs.on_split() == rs2.on_split()
+
+
 def benchmark_rollsum():
     bytes_size = 1024 * 1024 * 5
     rs = Rollsum()
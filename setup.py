@@ -3,7 +3,8 @@ from setuptools import setup, find_packages, Extension
 
 
 camlipy_rollsum = Extension('camlipy._rollsum',
-                            sources=['camlipy/rollsum_wrap.c', 'camlipy/rollsum.c'],
+                            sources=['camlipy/rollsum_wrap.c', 'camlipy/rollsum.c',
+                                     'camlipy/gear.c'],
                             )
 
 
@@ -23,6 +24,7 @@ setup(
     ext_modules=[camlipy_rollsum],
     long_description=read('README.rst'),
     install_requires=['dirtools', 'docopt', 'requests', 'ujson', 'futures'],
+    extras_require={'numpy': ['numpy']},
     test_requires=['sh'],
     test_suite="camlipy.tests",
     entry_points={'console_scripts': ['camlipy = camlipy.cli:main']},